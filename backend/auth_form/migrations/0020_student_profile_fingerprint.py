@@ -0,0 +1,43 @@
+import hashlib
+import json
+from django.db import migrations, models
+
+# a copy of auth_form.models.compute_profile_fingerprint as of this migration, so later changes to the
+# fingerprinted fields don't break it. fingerprints from another set of fields only cause a one time cache miss
+PROFILE_FINGERPRINT_FIELDS = (
+    'study_track', 'current_year', 'study_effort', 'total_credits', 'level_credits',
+    'tags', 'technologies', 'evaluation', 'professors', 'assistants',
+)
+
+def compute_profile_fingerprint(student, passed_ids):
+    profile = {field: getattr(student, field) for field in PROFILE_FINGERPRINT_FIELDS}
+    profile['passed_subjects'] = sorted(passed_ids)
+    encoded = json.dumps(profile, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:32]
+
+
+def fill_profile_fingerprints(apps, schema_editor):
+    Student = apps.get_model('auth_form', 'Student')
+    passed_ids = {}
+    for student_id, subject_id in Student.passed_subjects.through.objects.values_list('student_id', 'subject_id'):
+        passed_ids.setdefault(student_id, []).append(subject_id)
+    students = list(Student.objects.all())
+    for student in students:
+        student.profile_fingerprint = compute_profile_fingerprint(student, passed_ids.get(student.id, []))
+    Student.objects.bulk_update(students, ['profile_fingerprint'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_form', '0019_admin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='profile_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.RunPython(fill_profile_fingerprints, migrations.RunPython.noop),
+    ]
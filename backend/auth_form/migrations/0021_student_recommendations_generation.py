@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_form', '0020_student_profile_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='recommendations_generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
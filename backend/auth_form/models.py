@@ -1,4 +1,9 @@
-from django.db import models
+import hashlib
+import json
+import threading
+import weakref
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.contrib.postgres.fields import ArrayField
 
@@ -39,6 +44,27 @@ class User(AbstractUser):
     def get_user_type(self):
         return self.user_type
 
+# the student fields the recommendations depend on, besides the passed subjects
+PROFILE_FINGERPRINT_FIELDS = (
+    'study_track', 'current_year', 'study_effort', 'total_credits', 'level_credits',
+    'tags', 'technologies', 'evaluation', 'professors', 'assistants',
+)
+
+def compute_profile_fingerprint(student, passed_ids):
+    """
+    returns a deterministic digest of everything the recommendations of a student depend on.
+
+    args:
+        student: a Student instance (or any object with the PROFILE_FINGERPRINT_FIELDS attributes).
+        passed_ids (iterable): the ids of the subjects the student has passed.
+    returns:
+        str: a hex digest that is the same in every process for the same profile.
+    """
+    profile = {field: getattr(student, field) for field in PROFILE_FINGERPRINT_FIELDS}
+    profile['passed_subjects'] = sorted(passed_ids)
+    encoded = json.dumps(profile, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:32]
+
 class Student(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='student')
     index = models.CharField(max_length=20, unique=True, null=True, blank=True)
@@ -74,7 +100,41 @@ class Student(models.Model):
     )   
     # {1: [s1, s2, s3...], 2: [....], ...}
     passed_subjects_per_semester = models.JSONField(blank=True, null=True) 
+    # digest of the profile, kept up to date by the signals in auth_form/signals.py and used in the recommendations cache keys
+    profile_fingerprint = models.CharField(max_length=32, blank=True, default='')
+    # bumped to make all cached recommendations of the student unreachable, see invalidate_recommendations
+    recommendations_generation = models.PositiveIntegerField(default=0)
+    # written only with update queries, by the signals and invalidate_recommendations
+    CACHE_FIELDS = ('profile_fingerprint', 'recommendations_generation')
+
+    def save(self, *args, **kwargs):
+        # saving a loaded student leaves out the cache fields, so it can't roll back a change made since it was loaded
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.CACHE_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    def invalidate_recommendations(self):
+        """
+        makes all cached recommendations of the student unreachable by incrementing their generation.
+        the increment runs once the current transaction commits, and only once per transaction.
+        """
+        pending = getattr(pending_generation_bumps, 'students', None)
+        if pending is None:
+            pending = pending_generation_bumps.students = {}
+        key = (transaction.get_connection().alias, self.pk)
+        registered = pending.get(key)
+        if registered is not None and registered() is not None:
+            return
 
+        def bump():
+            pending.pop(key, None)
+            bump_recommendations_generation(self)
+
+        pending[key] = weakref.ref(bump)
+        transaction.on_commit(bump)
 
     def update_info(self, new_preferences):
         self.preferred_domains = new_preferences
@@ -93,6 +153,16 @@ class Student(models.Model):
         ]
 
 
+# the students whose generation increment waits for the current transaction of this thread to commit, with weak
+# references to the registered callbacks. django drops the callbacks of a rolled back transaction or savepoint,
+# which clears the references, so the student is invalidated again in the next transaction
+pending_generation_bumps = threading.local()
+
+def bump_recommendations_generation(student):
+    Student.objects.filter(pk=student.pk).update(recommendations_generation=F('recommendations_generation') + 1)
+    student.recommendations_generation += 1
+
+
 class Admin(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='admin')
 
@@ -109,7 +109,7 @@ class StudentFormSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Student
-        exclude = ['user', 'id']
+        exclude = ['user', 'id', 'profile_fingerprint', 'recommendations_generation']
     
     def to_representation(self, instance):
         rep = super().to_representation(instance)
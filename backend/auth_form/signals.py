@@ -1,8 +1,10 @@
-from django.core.cache import cache
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from .models import User, Student
-from subjects.utils import get_recommendations_cache_key
+from .models import User, Student, compute_profile_fingerprint
+from subjects.models import Subject
+from subjects.tasks import enqueue_student_recommendations
+from subjects.utils import get_passed_subject_ids
 
 @receiver(post_save, sender=User)
 def create_student_profile(sender, instance, created, **kwargs):
@@ -14,10 +16,77 @@ def save_student_profile(sender, instance, **kwargs):
     if instance.user_type == 'student':
         instance.student.save()
 
+def refresh_profile_fingerprint(student, passed_ids=None):
+    """
+    recomputes the profile fingerprint of a student and stores it if it has changed,
+    in which case the recommendations cached for the previous profile are invalidated.
+
+    args:
+        student: the student whose profile has changed.
+        passed_ids (iterable, optional): the ids of the student's passed subjects, read from the db when not given.
+    """
+    if passed_ids is None:
+        passed_ids = student.passed_subjects.values_list('id', flat=True)
+    fingerprint = compute_profile_fingerprint(student, passed_ids)
+    if fingerprint == student.profile_fingerprint:
+        return
+
+    Student.objects.filter(pk=student.pk).update(profile_fingerprint=fingerprint)
+    student.profile_fingerprint = fingerprint
+    student.invalidate_recommendations()
+    # so the new recommendations are usually cached before the student opens them
+    enqueue_student_recommendations([student.pk])
+
+def refresh_profile_fingerprints(students):
+    """
+    like refresh_profile_fingerprint for many students at once, e.g. after a bulk change with the signals
+    disconnected. the passed subjects are loaded in one query and the changed students are updated in bulk,
+    without queueing their recomputation.
+
+    returns:
+        int: the number of students whose fingerprint has changed.
+    """
+    students = list(students)
+    passed_ids = get_passed_subject_ids(students)
+    changed = []
+    for student in students:
+        fingerprint = compute_profile_fingerprint(student, passed_ids[student.id])
+        if fingerprint != student.profile_fingerprint:
+            student.profile_fingerprint = fingerprint
+            changed.append(student)
+    Student.objects.bulk_update(changed, ['profile_fingerprint'], batch_size=1000)
+    Student.objects.filter(pk__in=[student.pk for student in changed]).update(
+        recommendations_generation=F('recommendations_generation') + 1
+    )
+    return len(changed)
+
 @receiver(post_save, sender=Student)
-def invalidate_recommendations_cache(sender, instance, **kwargs):
-    for season in [0,1,2]:
-        for not_activated in [0, 1]:
-            cache_key = get_recommendations_cache_key(instance, season, not_activated)
-            if cache_key:
-                cache.delete(cache_key)
+def update_profile_fingerprint(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    refresh_profile_fingerprint(instance, passed_ids=[] if created else None)
+
+@receiver(m2m_changed, sender=Student.passed_subjects.through)
+def update_profile_fingerprint_on_passed_subjects(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_profile_fingerprint(instance)
+        return
+
+    # changed from the subject side, pk_set holds student ids (and is None when clearing)
+    if action == 'pre_clear':
+        instance._cleared_student_ids = list(instance.passed_subjects.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        student_ids = pk_set if action != 'post_clear' else getattr(instance, '_cleared_student_ids', [])
+        for student in Student.objects.filter(pk__in=student_ids):
+            refresh_profile_fingerprint(student)
+
+# deleting a subject removes it from the passed subjects without sending m2m_changed
+@receiver(pre_delete, sender=Subject)
+def remember_students_that_passed_subject(sender, instance, **kwargs):
+    instance._passed_by_student_ids = list(instance.passed_subjects.values_list('id', flat=True))
+
+@receiver(post_delete, sender=Subject)
+def update_profile_fingerprints_on_subject_delete(sender, instance, **kwargs):
+    for student in Student.objects.filter(pk__in=getattr(instance, '_passed_by_student_ids', [])):
+        refresh_profile_fingerprint(student)
@@ -1,3 +1,4 @@
+from django.db import transaction
 from auth_form.models import Student
 from auth_form.serializers import RegistrationSerializer, LoginSerializer, StudentFormSerializer, UserSerializer
 from rest_framework import status
@@ -82,9 +83,9 @@ class StudentFormView(APIView):
         serializer = StudentFormSerializer(instance=request.user.student, data=request.data)
 
         if serializer.is_valid():
-            serializer.save()
-            request.user.student.has_filled_form = True
-            request.user.student.save()
+            # one transaction, so the cached recommendations are invalidated once for all the changes
+            with transaction.atomic():
+                serializer.save(has_filled_form=True)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -101,7 +102,8 @@ class StudentFormView(APIView):
         serializer = StudentFormSerializer(instance=request.user.student, data=request.data)
 
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
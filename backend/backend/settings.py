@@ -112,9 +112,40 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
         'LOCATION': 'recommendations_cache',
-    }
+    },
+    # shared tier of the recommendations cache, e.g. django.core.cache.backends.redis.RedisCache with redis://host:6379.
+    # every student that has filled the form takes up to 7 entries (6 variants and the scores), the default leaves
+    # room for about 40000 students. FileCache only culls to MAX_ENTRIES in the periodic purge, not on every write
+    'recommendations': {
+        'BACKEND': config('RECOMMENDATIONS_CACHE_BACKEND', default='subjects.cache.FileCache'),
+        'LOCATION': config('RECOMMENDATIONS_CACHE_LOCATION', default=str(BASE_DIR / '.cache' / 'recommendations')),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('RECOMMENDATIONS_CACHE_MAX_ENTRIES', default=300000, cast=int),
+        },
+    },
+    # the reviews of each subject, see subjects/reviews.py. they are dropped on every vote, so they are kept out of
+    # the database cache, whose hits are queries and whose writes count (and cull) the whole table
+    'reviews': {
+        'BACKEND': config('REVIEWS_CACHE_BACKEND', default='subjects.cache.FileCache'),
+        'LOCATION': config('REVIEWS_CACHE_LOCATION', default=str(BASE_DIR / '.cache' / 'reviews')),
+    },
+}
+
+# in-process tier in front of CACHES['recommendations'], see subjects/cache.py
+RECOMMENDATIONS_CACHE = {
+    'SHARED_ALIAS': 'recommendations',
+    'LOCAL_MAX_ENTRIES': config('RECOMMENDATIONS_LOCAL_CACHE_MAX_ENTRIES', default=2048, cast=int),
+    'LOCAL_TIMEOUT': config('RECOMMENDATIONS_LOCAL_CACHE_TIMEOUT', default=60, cast=int),
+    'PURGE_INTERVAL': config('RECOMMENDATIONS_CACHE_PURGE_INTERVAL', default=600, cast=int),
 }
 
+# seconds a recommendations request waits for the personalised recommendations before it answers with the
+# cohort's top subjects instead (0 to always wait), the threads that compute them, and the most computations that
+# may be running or waiting for a thread at once (further misses are answered right away), see subjects/utils.py
+RECOMMENDATIONS_LATENCY_BUDGET = config('RECOMMENDATIONS_LATENCY_BUDGET', default=2.0, cast=float)
+RECOMMENDATIONS_COMPUTE_THREADS = config('RECOMMENDATIONS_COMPUTE_THREADS', default=4, cast=int)
+RECOMMENDATIONS_COMPUTE_QUEUE = config('RECOMMENDATIONS_COMPUTE_QUEUE', default=16, cast=int)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
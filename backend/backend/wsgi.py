@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# load the recommender data once per worker, instead of on the first request
+from subjects.artifacts import warm_up  # noqa: E402
+
+warm_up()
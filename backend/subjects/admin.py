@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Subject, Subject_Info
+from .models import Job, Subject, Subject_Info
 
 admin.site.register(Subject)
-admin.site.register(Subject_Info)
\ No newline at end of file
+admin.site.register(Subject_Info)
+admin.site.register(Job)
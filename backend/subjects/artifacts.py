@@ -0,0 +1,400 @@
+import hashlib
+import json
+import os
+import logging
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+import numpy as np
+from django.db import DatabaseError
+from subjects.consts import ARTIFACT_RELOAD_CHECK_INTERVAL, BIAS_STUDENT_HAS_ONE, BIAS_SUBJECT_HAS_ONE
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).resolve().parent / 'management' / 'data'
+
+VOCAB_FILE_PATH = DATA_DIR / 'vocabulary.json'
+TAG_GRAPH_PATH = DATA_DIR / 'tag_graph.json'
+SUBJECTS_VECTOR_PATH = DATA_DIR / 'subjects_vector.json'
+
+# binary artifacts: a .npy array that is memory-mapped at runtime, and a .meta.json file with its index, the checksum,
+# modification time and size of the .npy file, and the same of the JSON file it was built from
+SUBJECTS_ARTIFACT_PATH = DATA_DIR / 'subjects_vector.npy'
+SUBJECTS_ARTIFACT_META_PATH = DATA_DIR / 'subjects_vector.meta.json'
+TAG_GRAPH_ARTIFACT_PATH = DATA_DIR / 'tag_graph.npy'
+TAG_GRAPH_ARTIFACT_META_PATH = DATA_DIR / 'tag_graph.meta.json'
+
+ARTIFACT_FORMAT_VERSION = 3
+
+SCALAR_KEYS = ('isEasy', 'activated', 'season', 'year', 'participants')
+
+def pack_vector(values):
+    """
+    packs a binary vector (a list of 0s and 1s) into a bitset, 8 values per byte.
+
+    args:
+        values (list): a list of binary values.
+    returns:
+        numpy.ndarray: a uint8 array of length ceil(len(values) / 8).
+    """
+    return np.packbits(np.asarray(values, dtype=np.uint8))
+
+def unpack_vector(bits, length):
+    """
+    unpacks a bitset created by pack_vector back into a list of 0s and 1s.
+
+    args:
+        bits (numpy.ndarray): the packed uint8 array.
+        length (int): the length of the original vector.
+    returns:
+        list: a list of binary values.
+    """
+    return np.unpackbits(bits, count=length).tolist()
+
+def build_subject_matrices(subjects_vector, vocabulary):
+    """
+    stacks the subject vectors into one packed bitset matrix per feature group, so that all subjects can be scored in a single batched operation.
+
+    args:
+        subjects_vector (dict): a dictionary mapping subject names to their vector representations.
+        vocabulary (dict): a dictionary where each key is a feature group and the value is the list of its distinct values.
+    returns:
+        dict: a dictionary containing:
+            - 'index': mapping of subject names to their row in the matrices.
+            - one (subjects x ceil(vocabulary size / 8)) uint8 matrix for each vocabulary key, one bit per word.
+            - 'totals': the number of set bits in each row, for each vocabulary key.
+            - one array for each of the scalar keys ('isEasy', 'activated', 'season', 'year', 'participants').
+    """
+    names = list(subjects_vector)
+    matrices = {'index': {name: row for row, name in enumerate(names)}, 'totals': {}}
+    for key in vocabulary:
+        values = np.array(
+            [subjects_vector[name][key] for name in names], dtype=np.uint8
+        ).reshape(len(names), len(vocabulary[key]))
+        matrices[key] = np.packbits(values, axis=1)
+        matrices['totals'][key] = np.bitwise_count(matrices[key]).sum(axis=1, dtype=np.int64)
+    for key in SCALAR_KEYS:
+        matrices[key] = np.array([subjects_vector[name][key] for name in names], dtype=np.float64)
+    return matrices
+
+def unpack_subject_matrices(matrices, vocabulary):
+    """
+    converts the matrices created by build_subject_matrices back to the JSON form of subjects_vector.json.
+
+    args:
+        matrices (dict): the matrices created by build_subject_matrices.
+        vocabulary (dict): the vocabulary the matrices were built with.
+    returns:
+        dict: a dictionary mapping subject names to their vector representations.
+    """
+    subjects_vector = {}
+    for name, row in matrices['index'].items():
+        vector = {key: unpack_vector(matrices[key][row], len(vocabulary[key])) for key in vocabulary}
+        for key in SCALAR_KEYS:
+            value = float(matrices[key][row])
+            vector[key] = int(value) if value.is_integer() else value
+        subjects_vector[name] = vector
+    return subjects_vector
+
+def subjects_artifact_dtype(vocabulary):
+    """
+    the structured dtype of one row of the subjects artifact: the packed bitset and its popcount
+    for every vocabulary key, followed by the scalar keys.
+    """
+    fields = [(key, np.uint8, ((len(words) + 7) // 8,)) for key, words in vocabulary.items()]
+    fields += [(f'{key}_total', np.int64) for key in vocabulary]
+    fields += [(key, np.float64) for key in SCALAR_KEYS]
+    return np.dtype(fields)
+
+def tag_graph_to_matrix(tag_graph, number_of_tags):
+    """
+    converts the tag graph into a dense (number_of_tags x number_of_tags) matrix of edge weights.
+
+    args:
+        tag_graph (dict): a dictionary where each key is the index of a tag and each value is its adjacency list of (neighbor, weight) pairs.
+        number_of_tags (int): the number of tags in the vocabulary.
+    returns:
+        numpy.ndarray: the weight matrix, where element (i, j) is the weight of the edge from tag i to tag j.
+    """
+    weights = np.zeros((number_of_tags, number_of_tags))
+    for tag, neighbors in tag_graph.items():
+        for neighbor, weight in neighbors:
+            weights[int(tag), neighbor] += weight
+    return weights
+
+def file_checksum(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def file_stamp(path):
+    """returns the [modification time, size] of a file, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+def source_checksum(path):
+    """returns the checksum of the JSON file an artifact is built from, or None if the file is missing."""
+    return file_checksum(path) if os.path.exists(path) else None
+
+def is_current_artifact(meta, source_path):
+    """
+    an artifact is only used while the JSON file it was built from is unchanged, so rewriting the JSON file
+    without the artifact can't leave an outdated artifact in use. without the JSON file the artifact is used as it is.
+
+    the JSON file is only hashed when its modification time or size differ from the ones stored with the artifact,
+    e.g. after a checkout that rewrote it with the same content.
+    """
+    stamp = file_stamp(source_path)
+    if stamp is None or stamp == meta.get('source_stamp'):
+        return True
+    return meta.get('source') == source_checksum(source_path)
+
+def write_artifact(array, path, meta_path, meta):
+    """
+    writes an array as a .npy file together with its metadata and checksum.
+    both files are written to temporary files first and then moved into place.
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array, allow_pickle=False)
+    meta = {
+        'format': ARTIFACT_FORMAT_VERSION, **meta,
+        # moving the file into place keeps its modification time
+        'checksum': file_checksum(tmp_path), 'stamp': file_stamp(tmp_path),
+    }
+    tmp_meta_path = meta_path.with_name(meta_path.name + '.tmp')
+    with open(tmp_meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    os.replace(tmp_meta_path, meta_path)
+
+def read_artifact(path, meta_path):
+    """
+    memory-maps an artifact written by write_artifact.
+
+    the .npy file is only hashed when its modification time or size differ from the ones in the metadata (e.g.
+    after it was copied), otherwise loading it would read all of it.
+
+    returns:
+        tuple: the (array, metadata) pair, or (None, None) if the artifact is missing, has an unknown format or its checksum does not match.
+    """
+    stamp = file_stamp(path)
+    if stamp is None or not os.path.exists(meta_path):
+        return None, None
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('format') != ARTIFACT_FORMAT_VERSION:
+        return None, None
+    if stamp != meta.get('stamp') and meta.get('checksum') != file_checksum(path):
+        return None, None
+    return np.load(path, mmap_mode='r', allow_pickle=False), meta
+
+def write_subjects_artifact(subjects_vector, vocabulary):
+    """writes the subject vectors as a binary artifact, see subjects_artifact_dtype."""
+    matrices = build_subject_matrices(subjects_vector, vocabulary)
+    array = np.zeros(len(matrices['index']), dtype=subjects_artifact_dtype(vocabulary))
+    for key in vocabulary:
+        array[key] = matrices[key]
+        array[f'{key}_total'] = matrices['totals'][key]
+    for key in SCALAR_KEYS:
+        array[key] = matrices[key]
+    meta = {
+        'index': matrices['index'],
+        'vocabulary': {key: len(words) for key, words in vocabulary.items()},
+        'source': source_checksum(SUBJECTS_VECTOR_PATH),
+        'source_stamp': file_stamp(SUBJECTS_VECTOR_PATH),
+    }
+    write_artifact(array, SUBJECTS_ARTIFACT_PATH, SUBJECTS_ARTIFACT_META_PATH, meta)
+
+def write_tag_graph_artifact(tag_graph, number_of_tags):
+    """writes the tag graph as a binary artifact containing its weight matrix."""
+    weights = tag_graph_to_matrix(tag_graph, number_of_tags)
+    meta = {'tags': number_of_tags, 'source': source_checksum(TAG_GRAPH_PATH), 'source_stamp': file_stamp(TAG_GRAPH_PATH)}
+    write_artifact(weights, TAG_GRAPH_ARTIFACT_PATH, TAG_GRAPH_ARTIFACT_META_PATH, meta)
+
+def load_json(path):
+    """returns the parsed content of a JSON file together with the checksum of the file."""
+    with open(path, 'rb') as f:
+        content = f.read()
+    return json.loads(content.decode('utf-8')), hashlib.sha256(content).hexdigest()
+
+def load_vocabulary():
+    """returns the vocabulary and its checksum."""
+    if not os.path.exists(VOCAB_FILE_PATH):
+        raise FileNotFoundError("required data file is missing. ensure 'vocabulary.json' is present in the 'management/data' directory.")
+    return load_json(VOCAB_FILE_PATH)
+
+def load_subject_matrices(vocabulary):
+    """
+    loads the subject matrices (see build_subject_matrices) from the memory-mapped binary artifact,
+    falling back to parsing subjects_vector.json when the artifact is missing, invalid, built with a different
+    vocabulary or built from another version of subjects_vector.json.
+
+    returns:
+        tuple: the matrices and the checksum of subjects_vector.json (or of the artifact, if only the artifact exists).
+    """
+    array, meta = read_artifact(SUBJECTS_ARTIFACT_PATH, SUBJECTS_ARTIFACT_META_PATH)
+    if (array is not None and meta['vocabulary'] == {key: len(words) for key, words in vocabulary.items()}
+            and is_current_artifact(meta, SUBJECTS_VECTOR_PATH)):
+        matrices = {'index': meta['index'], 'totals': {}}
+        for key in vocabulary:
+            matrices[key] = array[key]
+            matrices['totals'][key] = array[f'{key}_total']
+        for key in SCALAR_KEYS:
+            matrices[key] = array[key]
+        return matrices, meta.get('source') or meta['checksum']
+
+    if not os.path.exists(SUBJECTS_VECTOR_PATH):
+        raise FileNotFoundError("required data file is missing. ensure 'subjects_vector.json' is present in the 'management/data' directory.")
+    subjects_vector, checksum = load_json(SUBJECTS_VECTOR_PATH)
+    return build_subject_matrices(subjects_vector, vocabulary), checksum
+
+def load_tag_weights(number_of_tags):
+    """
+    loads the weight matrix of the tag graph (see tag_graph_to_matrix) from the memory-mapped binary artifact,
+    falling back to parsing tag_graph.json when the artifact is missing, invalid or built from another version of it.
+
+    returns:
+        tuple: the weight matrix and the checksum of tag_graph.json (or of the artifact, if only the artifact exists).
+    """
+    weights, meta = read_artifact(TAG_GRAPH_ARTIFACT_PATH, TAG_GRAPH_ARTIFACT_META_PATH)
+    if weights is not None and meta['tags'] == number_of_tags and is_current_artifact(meta, TAG_GRAPH_PATH):
+        return weights, meta.get('source') or meta['checksum']
+
+    if not os.path.exists(TAG_GRAPH_PATH):
+        raise FileNotFoundError("required data file is missing. ensure 'tag_graph.json' is present in the 'management/data' directory.")
+    tag_graph, checksum = load_json(TAG_GRAPH_PATH)
+    return tag_graph_to_matrix(tag_graph, number_of_tags), checksum
+
+def compile_tag_graph(weights):
+    """
+    compiles the weight matrix of the tag graph into row-normalized weight matrices used for scoring partial tag matches.
+
+    row i of each matrix holds the weights of the edges going out of tag i, divided by their sum,
+    with BIAS_STUDENT_HAS_ONE and BIAS_SUBJECT_HAS_ONE respectively already applied.
+
+    args:
+        weights (numpy.ndarray): the (tags x tags) weight matrix of the tag graph, see tag_graph_to_matrix.
+    returns:
+        tuple: the (student_has_one, subject_has_one) weight matrices, both of the same shape as weights.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    total_weights = weights.sum(axis=1, keepdims=True)
+    normalized = np.divide(weights, total_weights, out=np.zeros_like(weights), where=total_weights != 0)
+    return normalized * BIAS_STUDENT_HAS_ONE, normalized * BIAS_SUBJECT_HAS_ONE
+
+RecommenderData = namedtuple('RecommenderData', [
+    'vocabulary', 'subject_matrices', 'tag_weights_student_has_one', 'tag_weights_subject_has_one', 'version'
+])
+
+def load_recommender_data():
+    """
+    loads the vocabulary, the subject matrices and the compiled tag graph.
+    the version of the loaded set is a hash of the content of the files it was loaded from.
+    """
+    vocabulary, vocabulary_checksum = load_vocabulary()
+    subject_matrices, subjects_checksum = load_subject_matrices(vocabulary)
+    tag_weights, tag_graph_checksum = load_tag_weights(len(vocabulary['tags']))
+    student_has_one, subject_has_one = compile_tag_graph(tag_weights)
+    version = hashlib.sha256(
+        f"{vocabulary_checksum}:{subjects_checksum}:{tag_graph_checksum}".encode()
+    ).hexdigest()[:16]
+    return RecommenderData(vocabulary, subject_matrices, student_has_one, subject_has_one, version)
+
+def data_files_signature():
+    """the modification time and size of every file the recommender data can be loaded from."""
+    signature = []
+    for path in (VOCAB_FILE_PATH, SUBJECTS_VECTOR_PATH, TAG_GRAPH_PATH, SUBJECTS_ARTIFACT_PATH,
+                 SUBJECTS_ARTIFACT_META_PATH, TAG_GRAPH_ARTIFACT_PATH, TAG_GRAPH_ARTIFACT_META_PATH):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+# the registry of the currently loaded recommender data, see get_recommender_data
+_data = None
+_data_signature = None
+_data_checked_at = 0
+_data_lock = threading.Lock()
+
+def _refresh_recommender_data(force=False):
+    """
+    reloads the recommender data if its files have changed since the last load, and swaps it in if its version differs.
+    must be called with _data_lock held.
+    """
+    global _data, _data_signature, _data_checked_at
+    _data_checked_at = time.monotonic()
+    signature = data_files_signature()
+    if _data is not None and signature == _data_signature and not force:
+        return
+
+    try:
+        data = load_recommender_data()
+    except (OSError, ValueError):
+        if _data is None:
+            raise
+        # e.g. a file that is still being written, keep serving the current set until the next check
+        logger.warning("could not reload the recommender data, keeping version %s", _data.version, exc_info=True)
+        return
+
+    _data_signature = signature
+    if _data is None or data.version != _data.version:
+        if _data is not None:
+            logger.info("recommender data reloaded: version %s -> %s", _data.version, data.version)
+            enqueue_warm_up()
+        _data = data
+
+def enqueue_warm_up():
+    """
+    queues the recomputation of all precomputed recommendations after the recommender data has changed, since the
+    data version is part of their keys. every process that reloads queues it, the dedupe key keeps one job waiting.
+    the job waits until the workers have reloaded the data too.
+    """
+    # the tasks import this module
+    from subjects.tasks import enqueue
+    try:
+        enqueue('warm_up_recommendations', dedupe_key='warm_up', delay=2 * ARTIFACT_RELOAD_CHECK_INTERVAL)
+    except DatabaseError:
+        logger.warning("could not queue the warm up of the recommendations", exc_info=True)
+
+def get_recommender_data():
+    """
+    returns the data used by the recommender, loading it on first use.
+
+    the data is loaded at most once per process, even when called from several threads at the same time.
+    at most once every ARTIFACT_RELOAD_CHECK_INTERVAL seconds the data files are checked for changes, and a
+    changed set is loaded and swapped in without a restart. a request should call this once and pass the
+    returned snapshot on, so it never mixes two versions.
+    """
+    data = _data
+    if data is None:
+        with _data_lock:
+            if _data is None:
+                _refresh_recommender_data()
+            return _data
+
+    if time.monotonic() - _data_checked_at >= ARTIFACT_RELOAD_CHECK_INTERVAL and _data_lock.acquire(blocking=False):
+        # only one thread checks, the others keep using the current set in the meantime
+        try:
+            _refresh_recommender_data()
+        finally:
+            _data_lock.release()
+    return _data
+
+def reload_recommender_data():
+    """forces a reload of the recommender data and returns the version that is loaded afterwards."""
+    with _data_lock:
+        _refresh_recommender_data(force=True)
+        return _data.version
+
+def warm_up():
+    """
+    loads the recommender data eagerly, so the first request doesn't pay for it.
+    called by backend/wsgi.py and backend/asgi.py, i.e. in every server worker after it has been forked.
+    """
+    get_recommender_data()
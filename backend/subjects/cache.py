@@ -0,0 +1,499 @@
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import close_old_connections, connections, router
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger(__name__)
+
+# returned by LocalCache.get when a key is missing, so that falsy values can be cached
+MISSING = object()
+
+# responses shorter than this are not worth compressing
+GZIP_MIN_LENGTH = 512
+
+# a value stored by TwoTierCache.get_or_set, fresh until the fresh_until timestamp and stale afterwards.
+# version identifies the data the value was computed from, entries of another version are never served
+StaleableEntry = namedtuple('StaleableEntry', ['value', 'fresh_until', 'version'])
+
+# a rendered response as stored in the cache, gzipped is None when the body is too short to be compressed
+CachedResponse = namedtuple('CachedResponse', ['body', 'gzipped', 'etag'])
+
+
+class LocalCache:
+    """
+    bounded, thread-safe, in-process LRU cache with a TTL per entry.
+    when full, the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_entries, default_timeout):
+        self.max_entries = max_entries
+        self.default_timeout = default_timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=MISSING):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else min(timeout, self.default_timeout)
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def purge_expired(self):
+        """removes all expired entries and returns how many were removed."""
+        now = time.monotonic()
+        with self.lock:
+            expired = [key for key, (_, expires_at) in self.entries.items() if expires_at <= now]
+            for key in expired:
+                del self.entries[key]
+            self.expirations += len(expired)
+        return len(expired)
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class FileCache(FileBasedCache):
+    """
+    FileBasedCache without culling on every write and with an atomic add, the default shared tier of the
+    recommendations cache.
+
+    FileBasedCache.set lists the whole cache directory to check MAX_ENTRIES, and once the cache is full it deletes
+    a random third of it on every write. here MAX_ENTRIES is a soft limit enforced by cull, which TwoTierCache calls
+    after each periodic purge of the expired entries.
+    """
+
+    def _cull(self):
+        pass
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        stores value only if key is missing or expired, atomically across processes, so TwoTierCache can use it
+        as a lock. FileBasedCache.add checks for the file and writes it in two steps, so several processes can
+        all add the same key.
+
+        the value is written to a temporary file that is then hard linked to the key's file, which fails if the
+        file already exists. an expired file is removed and the link is tried once more.
+        """
+        self._createdir()
+        fname = self._key_to_file(key, version)
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir)
+        try:
+            with open(fd, 'wb') as f:
+                self._write_content(f, timeout, value)
+            for _ in range(2):
+                try:
+                    os.link(tmp_path, fname)
+                    return True
+                except FileExistsError:
+                    try:
+                        with open(fname, 'rb') as f:
+                            # _is_expired deletes the file when it has expired
+                            if not self._is_expired(f):
+                                return False
+                    except FileNotFoundError:
+                        pass
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def cull(self):
+        """
+        removes the least recently written entries above MAX_ENTRIES.
+
+        returns:
+            int: the number of removed entries.
+        """
+        entries = []
+        for path in self._list_cache_files():
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:
+                pass
+        excess = len(entries) - self._max_entries
+        if excess <= 0:
+            return 0
+        entries.sort()
+        for _, path in entries[:excess]:
+            self._delete(path)
+        return excess
+
+
+def cull_entries(shared):
+    """
+    removes the entries of a shared cache backend above its maximal number of entries, for the backends that
+    don't do it on their own when written (FileCache).
+
+    returns:
+        int: the number of removed entries.
+    """
+    if isinstance(shared, FileCache):
+        return shared.cull()
+    return 0
+
+
+def purge_expired_entries(shared):
+    """
+    removes the expired entries of a shared cache backend, for the backends that don't expire entries by themselves.
+
+    returns:
+        int: the number of removed entries.
+    """
+    if isinstance(shared, DatabaseCache):
+        db = router.db_for_write(shared.cache_model_class)
+        connection = connections[db]
+        table = connection.ops.quote_name(shared._table)
+        now = timezone.now() if settings.USE_TZ else timezone.now().replace(tzinfo=None)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE expires < %s", [now])
+            return cursor.rowcount
+    if isinstance(shared, FileBasedCache):
+        purged = 0
+        for path in shared._list_cache_files():
+            try:
+                with open(path, 'rb') as f:
+                    # _is_expired deletes the file when it has expired
+                    purged += shared._is_expired(f)
+            except FileNotFoundError:
+                pass
+        return purged
+    # memcached and redis expire entries by themselves
+    return 0
+
+
+class TwoTierCache:
+    """
+    cache with a bounded in-process LRU (LocalCache) in front of a shared Django cache backend.
+
+    reads are served from the local tier when possible and fall through to the shared tier, whose hits are copied
+    into the local tier. writes and deletes go to both tiers. local entries live for at most LOCAL_TIMEOUT seconds,
+    which bounds how long a process can serve an entry that another process has deleted from the shared tier.
+
+    the configuration is read from settings.RECOMMENDATIONS_CACHE:
+        - SHARED_ALIAS: the alias in settings.CACHES of the shared tier. its add is used as the lock of get_or_set across
+          processes, so it has to be atomic: FileCache, redis, memcached and the database cache qualify, Django's
+          FileBasedCache and the local memory cache don't.
+        - LOCAL_MAX_ENTRIES: the maximal number of entries in the local tier.
+        - LOCAL_TIMEOUT: the maximal lifetime of an entry in the local tier, in seconds.
+        - PURGE_INTERVAL: seconds between background purges of expired entries, or None to disable them.
+        - LOCK_TIMEOUT: seconds after which the lock of a computation in get_or_set expires, if it was not released.
+        - WAIT_TIMEOUT: seconds get_or_set waits for a value that is being computed elsewhere.
+    """
+
+    def __init__(self, config=None):
+        self.config = config
+        self.local = None
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_purged = 0
+        self.shared_evictions = 0
+        self.setup_lock = threading.Lock()
+        self.purger = None
+        self.computing = set()
+        self.computing_lock = threading.Lock()
+
+    def setup(self):
+        if self.local is not None:
+            return
+        with self.setup_lock:
+            if self.local is not None:
+                return
+            config = self.config or settings.RECOMMENDATIONS_CACHE
+            self.shared_alias = config['SHARED_ALIAS']
+            self.purge_interval = config.get('PURGE_INTERVAL')
+            self.lock_timeout = config.get('LOCK_TIMEOUT', 30)
+            self.wait_timeout = config.get('WAIT_TIMEOUT', 10)
+            self.local = LocalCache(config['LOCAL_MAX_ENTRIES'], config['LOCAL_TIMEOUT'])
+            if type(self.shared) is FileBasedCache:
+                logger.warning(
+                    "the shared tier %s is a FileBasedCache, whose add is not atomic, so concurrent misses may be "
+                    "computed more than once. use subjects.cache.FileCache instead", self.shared_alias
+                )
+            if self.purge_interval:
+                self.purger = threading.Thread(target=self.purge_periodically, name='recommendations-cache-purger', daemon=True)
+                self.purger.start()
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def get(self, key, default=None):
+        self.setup()
+        value = self.local.get(key)
+        if value is not MISSING:
+            return value
+        value = self.shared.get(key, MISSING)
+        if value is MISSING:
+            self.shared_misses += 1
+            return default
+        self.shared_hits += 1
+        self.local.set(key, value)
+        return value
+
+    def set(self, key, value, timeout):
+        self.setup()
+        self.shared.set(key, value, timeout=timeout)
+        self.local.set(key, value, timeout)
+
+    def set_many(self, entries, timeout):
+        self.setup()
+        self.shared.set_many(entries, timeout=timeout)
+        for key, value in entries.items():
+            self.local.set(key, value, timeout)
+
+    def delete(self, key):
+        self.setup()
+        self.local.delete(key)
+        self.shared.delete(key)
+
+    def delete_many(self, keys):
+        self.setup()
+        for key in keys:
+            self.local.delete(key)
+        self.shared.delete_many(keys)
+
+    def set_staleable(self, key, value, timeout, stale_timeout=0, version=None):
+        """stores a value in the form read by get_or_set."""
+        self.set(key, StaleableEntry(value, time.time() + timeout, version), timeout=timeout + stale_timeout)
+
+    def set_many_staleable(self, entries, timeout, stale_timeout=0, versions=None):
+        """stores many values in the form read by get_or_set, versions maps keys to the versions of their values."""
+        versions = versions or {}
+        fresh_until = time.time() + timeout
+        self.set_many(
+            {key: StaleableEntry(value, fresh_until, versions.get(key)) for key, value in entries.items()},
+            timeout=timeout + stale_timeout
+        )
+
+    def get_entry(self, key, version=None, shared_only=False):
+        """returns the StaleableEntry of key, or None if there is none or it was computed from another version."""
+        entry = self.shared.get(key) if shared_only else self.get(key)
+        if entry is None or (version is not None and entry.version != version):
+            return None
+        return entry
+
+    def acquire(self, key):
+        """
+        takes the lock for computing key, in this process and in the shared tier.
+        returns False if another thread or process is already computing it.
+        """
+        with self.computing_lock:
+            if key in self.computing:
+                return False
+            self.computing.add(key)
+        if not self.shared.add(f"lock_{key}", 1, timeout=self.lock_timeout):
+            with self.computing_lock:
+                self.computing.discard(key)
+            return False
+        return True
+
+    def release(self, key):
+        self.shared.delete(f"lock_{key}")
+        with self.computing_lock:
+            self.computing.discard(key)
+
+    def compute_and_set(self, key, compute, timeout, stale_timeout, cacheable, version):
+        value = compute()
+        if cacheable is None or cacheable(value):
+            self.set_staleable(key, value, timeout, stale_timeout, version)
+        return value
+
+    def refresh(self, key, compute, timeout, stale_timeout, cacheable, version):
+        try:
+            self.compute_and_set(key, compute, timeout, stale_timeout, cacheable, version)
+        except Exception:
+            logger.exception("could not refresh the cached value of %s", key)
+        finally:
+            self.release(key)
+            # the connections of this thread would be left open otherwise
+            connections.close_all()
+
+    def wait_for(self, key, version=None, timeout=None):
+        """
+        polls the cache for a value that is being computed elsewhere, for up to timeout seconds (WAIT_TIMEOUT if not
+        given). returns None if it doesn't show up in time, or if the computation ended without storing it.
+        """
+        deadline = time.monotonic() + (self.wait_timeout if timeout is None else timeout)
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            with self.computing_lock:
+                computing_here = key in self.computing
+            # the value is stored before the lock is released, so it is read after checking the lock
+            done = not computing_here and not self.shared.has_key(f"lock_{key}")
+            entry = self.get_entry(key, version)
+            if entry is not None or done:
+                return entry
+        return None
+
+    def get_or_set(self, key, compute, timeout, stale_timeout=0, cacheable=None, version=None, submit=None):
+        """
+        returns the cached value of key, calling compute() to compute and cache it on a miss.
+
+        a key is computed by one caller at a time: the others wait for its result for up to WAIT_TIMEOUT seconds
+        and only compute it themselves if it doesn't show up. values are fresh for timeout seconds, and are then
+        served stale for up to stale_timeout seconds while a single caller has them recomputed through submit.
+        when submit has no room (or isn't given) the stale value is served without a refresh, and a later
+        request tries again.
+
+        args:
+            key (str): the cache key.
+            compute (callable): computes the value, it has to be safe to call from another thread.
+            timeout (int): seconds the value is fresh.
+            stale_timeout (int, optional): seconds the value is served stale after it stops being fresh.
+            cacheable (callable, optional): decides whether a computed value is stored, all values are stored if not given.
+            version (str, optional): the version of the data the value depends on. a cached value of another version
+                is treated as a miss, and is not served even as stale.
+            submit (callable, optional): runs the refresh of a stale value in the background, called with a function
+                and its arguments. returns None when it can't take the refresh, e.g. a full bounded pool.
+        """
+        entry = self.get(key)
+        outdated = entry is not None and version is not None and entry.version != version
+        if outdated or (entry is not None and entry.fresh_until <= time.time()):
+            # another process may have refreshed it already, while this process still has the old entry
+            shared_entry = self.get_entry(key, version, shared_only=True)
+            if shared_entry is not None and (outdated or shared_entry.fresh_until > entry.fresh_until):
+                entry, outdated = shared_entry, False
+                self.local.set(key, entry)
+        if entry is not None and not outdated:
+            if entry.fresh_until <= time.time() and submit is not None and self.acquire(key):
+                if submit(self.refresh, key, compute, timeout, stale_timeout, cacheable, version) is None:
+                    self.release(key)
+            return entry.value
+
+        if not self.acquire(key):
+            entry = self.wait_for(key, version)
+            if entry is not None:
+                return entry.value
+            return self.compute_and_set(key, compute, timeout, stale_timeout, cacheable, version)
+
+        try:
+            # the value may have been stored between the miss and taking the lock
+            entry = self.get_entry(key, version)
+            if entry is not None:
+                return entry.value
+            return self.compute_and_set(key, compute, timeout, stale_timeout, cacheable, version)
+        finally:
+            self.release(key)
+
+    def purge_expired(self):
+        """
+        removes the expired entries from the local tier, and from the shared tier if no other process has done so
+        during the last PURGE_INTERVAL seconds. the shared tier is then culled to its maximal number of entries,
+        for the backends that don't cull on write.
+        """
+        self.setup()
+        self.local.purge_expired()
+        if self.shared.add(f"{self.shared_alias}_purge_lock", 1, timeout=self.purge_interval or 60):
+            self.shared_purged += purge_expired_entries(self.shared)
+            self.shared_evictions += cull_entries(self.shared)
+
+    def purge_periodically(self):
+        while True:
+            time.sleep(self.purge_interval)
+            try:
+                self.purge_expired()
+                logger.debug("recommendations cache stats: %s", self.stats())
+            except Exception:
+                logger.exception("could not purge the recommendations cache")
+            finally:
+                close_old_connections()
+
+    def stats(self):
+        """hit, miss and eviction counters of both tiers, for this process."""
+        self.setup()
+        return {
+            'local': self.local.stats(),
+            'shared': {
+                'hits': self.shared_hits,
+                'misses': self.shared_misses,
+                'purged': self.shared_purged,
+                'evictions': self.shared_evictions,
+            },
+        }
+
+
+recommendations_cache = TwoTierCache()
+
+
+def build_cached_response(payload):
+    """
+    renders a response payload once into the form that is stored in the cache.
+
+    args:
+        payload: the data of the response, as it would be passed to rest_framework's Response.
+    returns:
+        CachedResponse: the rendered json body, its gzipped version and an etag of the body.
+    """
+    body = JSONRenderer().render(payload)
+    gzipped = gzip.compress(body, compresslevel=6, mtime=0) if len(body) >= GZIP_MIN_LENGTH else None
+    etag = f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+    return CachedResponse(body, gzipped, etag)
+
+
+def cached_response(request, entry, status=200):
+    """
+    returns an http response that sends the stored bytes of a CachedResponse without rendering them again.
+    the gzipped body is sent when the client accepts it, and 304 when the client already has the same body.
+    """
+    if entry.etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = entry.etag
+        return response
+
+    if entry.gzipped is not None and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = HttpResponse(entry.gzipped, content_type='application/json', status=status)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(entry.body, content_type='application/json', status=status)
+    response['ETag'] = entry.etag
+    response['Vary'] = 'Accept-Encoding'
+    return response
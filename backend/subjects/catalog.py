@@ -0,0 +1,345 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import namedtuple
+import numpy as np
+from django.core.cache import cache
+from subjects.consts import CATALOG_VERSION_CACHE_KEY, CATALOG_VERSION_CHECK_INTERVAL
+from subjects.models import Subject
+
+SubjectRecord = namedtuple('SubjectRecord', [
+    'id', 'name', 'code', 'level', 'semester', 'season', 'activated', 'is_easy', 'elective_for', 'prerequisite',
+    'revision'
+])
+
+# the candidate subjects of a cohort that can be scored, as parallel arrays in catalog order, see CatalogIndex.cohort_vectors
+CohortVectors = namedtuple('CohortVectors', ['bits', 'rows', 'ids', 'names'])
+
+
+def iter_bits(mask):
+    """yields the positions of the set bits in mask, from the lowest to the highest."""
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+def mask_to_array(mask, size):
+    """converts a bitmask to a boolean numpy array of the given size, where element i is bit i of the mask."""
+    mask_bytes = (mask & ((1 << size) - 1)).to_bytes((size + 7) // 8, 'little')
+    return np.unpackbits(np.frombuffer(mask_bytes, dtype=np.uint8), count=size, bitorder='little').astype(bool)
+
+
+class PrerequisiteGraph:
+    """
+    compiled form of the prerequisites stored in Subject_Info.prerequisite.
+
+    a prerequisite is either {"credits": N} or {"subjects": [ids]}, where passing any one of the listed subjects is enough.
+    for every subject (identified by its bit in the catalog index) the graph keeps the bitmask of the alternative
+    subjects and the credit threshold, as python ints for single students and as numpy arrays for batches of students.
+    the edges form a DAG from each subject to the subjects it unlocks.
+    prerequisite subjects that are not in the catalog can never be satisfied.
+    """
+
+    def __init__(self, records, bit_by_id):
+        size = len(records)
+        self.alternatives = {}
+        self.unlocks = [0] * size
+        self.credits = np.zeros(size, dtype=np.int64)
+        self.alternatives_matrix = np.zeros((size, size), dtype=bool)
+        for bit, record in enumerate(records):
+            self.credits[bit] = record.prerequisite.get('credits') or 0
+            required_subjects = record.prerequisite.get('subjects')
+            if not required_subjects:
+                continue
+            alternatives = 0
+            for subject_id in required_subjects:
+                required_bit = bit_by_id.get(subject_id)
+                if required_bit is None:
+                    continue
+                alternatives |= 1 << required_bit
+                self.unlocks[required_bit] |= 1 << bit
+                self.alternatives_matrix[bit, required_bit] = True
+            self.alternatives[bit] = alternatives
+        self.requires_subjects = np.zeros(size, dtype=bool)
+        self.requires_subjects[list(self.alternatives)] = True
+
+        # subjects grouped by credit threshold, so a single student only needs one check per distinct threshold
+        self.credit_masks = []
+        for threshold in np.unique(self.credits[self.credits > 0]).tolist():
+            mask = 0
+            for bit in np.flatnonzero(self.credits == threshold).tolist():
+                mask |= 1 << bit
+            self.credit_masks.append((threshold, mask))
+
+    def unlocked_mask(self, passed_mask, total_credits):
+        """
+        returns the bitmask of subjects whose prerequisites are met by a single student.
+
+        args:
+            passed_mask (int): bitmask of the subjects the student has passed.
+            total_credits (int): the student's total credits.
+        """
+        total_credits = total_credits or 0
+        blocked = 0
+        for threshold, mask in self.credit_masks:
+            if total_credits < threshold:
+                blocked |= mask
+        for bit, alternatives in self.alternatives.items():
+            if not alternatives & passed_mask:
+                blocked |= 1 << bit
+        return ~blocked
+
+    def unlocked_matrix(self, passed, total_credits):
+        """
+        evaluates the prerequisites for a batch of students in one vectorized pass.
+
+        args:
+            passed (numpy.ndarray): a (students x subjects) boolean matrix of passed subjects, in catalog bit order.
+            total_credits (numpy.ndarray): the total credits of each student.
+        returns:
+            numpy.ndarray: a (students x subjects) boolean matrix, True where the student meets the subject's prerequisites.
+        """
+        passed = np.asarray(passed, dtype=np.float64)
+        total_credits = np.asarray(total_credits, dtype=np.int64)
+        has_alternative = (passed @ self.alternatives_matrix.T.astype(np.float64)) > 0
+        subjects_ok = has_alternative | ~self.requires_subjects
+        credits_ok = self.credits[np.newaxis, :] <= total_credits[:, np.newaxis]
+        return subjects_ok & credits_ok
+
+    def unlocked_by(self, bit):
+        """returns the bitmask of subjects that list the subject at bit as one of their prerequisite alternatives."""
+        return self.unlocks[bit]
+
+
+class CatalogIndex:
+    """
+    process-local, read-only index of the subject catalog used for computing eligibility without querying the db.
+
+    every subject with subject info gets one bit (its position in `records`, ordered by id), and the subjects are
+    pre-bucketed into bitmasks by study track, season, semester, level, is_easy and activated, so that
+    filtering the catalog is reduced to AND/OR operations on python ints.
+    """
+
+    def __init__(self, records, shared_version):
+        self.records = records
+        self.shared_version = shared_version
+        self.checked_at = time.monotonic()
+        self.bit_by_id = {record.id: bit for bit, record in enumerate(records)}
+        self.all = (1 << len(records)) - 1
+        self.track = {}
+        self.season = {}
+        self.semester = {}
+        self.level = {}
+        self.easy = 0
+        self.activated = 0
+        for bit, record in enumerate(records):
+            flag = 1 << bit
+            for study_track in record.elective_for:
+                self.track[study_track] = self.track.get(study_track, 0) | flag
+            self.season[record.season] = self.season.get(record.season, 0) | flag
+            self.semester[record.semester] = self.semester.get(record.semester, 0) | flag
+            self.level[record.level] = self.level.get(record.level, 0) | flag
+            if record.is_easy:
+                self.easy |= flag
+            if record.activated:
+                self.activated |= flag
+        self.prerequisites = PrerequisiteGraph(records, self.bit_by_id)
+        # memoized per cohort, there are only a few hundred cohorts
+        self.cohort_masks = {}
+        self.cohort_revisions = {}
+        self.cohort_vectors_version = None
+        self.cohort_vectors_by_cohort = {}
+
+    @classmethod
+    def build(cls, shared_version):
+        subjects = (Subject.objects
+            .filter(subject_info__isnull=False)
+            .select_related('subject_info')
+            .order_by('id')
+        )
+        records = []
+        for subject in subjects:
+            info = subject.subject_info
+            records.append(SubjectRecord(
+                id=subject.id,
+                name=subject.name,
+                code=subject.code,
+                level=info.level,
+                semester=info.semester,
+                season=info.season,
+                activated=info.activated,
+                is_easy=info.is_easy,
+                elective_for=tuple(info.elective_for),
+                prerequisite=info.prerequisite or {},
+                revision=max(subject.updated_at, info.updated_at).isoformat(),
+            ))
+        return cls(records, shared_version)
+
+    def mask_of(self, subject_ids):
+        """returns the bitmask of the given subject ids, ignoring ids that are not in the catalog."""
+        mask = 0
+        for subject_id in subject_ids:
+            bit = self.bit_by_id.get(subject_id)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    def ids_of(self, mask):
+        """returns the ids of all subjects in mask, ordered by id."""
+        return [self.records[bit].id for bit in iter_bits(mask)]
+
+    def records_of(self, mask):
+        """returns the records of all subjects in mask, ordered by id."""
+        return [self.records[bit] for bit in iter_bits(mask)]
+
+    def unlocked_by(self, subject_id):
+        """returns the records of the subjects for which passing subject_id satisfies the subject prerequisites."""
+        bit = self.bit_by_id.get(subject_id)
+        return self.records_of(self.prerequisites.unlocked_by(bit)) if bit is not None else []
+
+    def semesters_mask(self, predicate):
+        mask = 0
+        for semester, semester_mask in self.semester.items():
+            if predicate(semester):
+                mask |= semester_mask
+        return mask
+
+    def variant_mask(self, season=2, not_activated=0):
+        """
+        returns the bitmask of subjects that pass the season and activation filters.
+        these are the only filters that differ between the variants of a student's recommendations.
+        """
+        mask = self.all
+        if not_activated == 0:
+            mask &= self.activated
+
+        if season == 0:
+            mask &= ~self.season.get('W', 0)
+        elif season == 1:
+            mask &= ~self.season.get('S', 0)
+        return mask
+
+    def candidates_mask(self, study_track, study_effort, current_year, level_credits, season=2, not_activated=0):
+        """
+        returns the bitmask of subjects that pass the catalog filters of the eligibility criteria (see
+        get_recommendations in subjects/utils.py), i.e. everything except passed subjects and prerequisites.
+        """
+        mask = self.track.get(study_track, 0) & self.variant_mask(season, not_activated)
+
+        if study_effort < 3:
+            mask &= self.semesters_mask(lambda semester: semester <= current_year * 2)
+            if study_effort == 1:
+                mask &= self.easy
+        elif study_effort == 3:
+            mask &= self.semesters_mask(lambda semester: semester in (current_year * 2, current_year * 2 - 1))
+        else:
+            mask &= self.semesters_mask(lambda semester: semester >= current_year * 2 - 1)
+            if study_effort == 5:
+                mask &= ~self.easy
+
+        if level_credits[0] >= 6:
+            mask &= ~self.level.get(1, 0)
+        if level_credits[1] >= 36:
+            mask &= ~self.level.get(2, 0)
+
+        return mask & self.all
+
+    def cohort_candidates(self, study_track, study_effort, current_year, level_credits, season=2, not_activated=0):
+        """
+        returns candidates_mask for the cohort of a student, computing it only once per cohort.
+        the level credits only matter through whether the L1 and L2 limits are reached, so the cohort is
+        (study track, study effort, current year, L1 reached, L2 reached, season, not_activated).
+        """
+        cohort = (study_track, study_effort, current_year, level_credits[0] >= 6, level_credits[1] >= 36, season, not_activated)
+        mask = self.cohort_masks.get(cohort)
+        if mask is None:
+            mask = self.candidates_mask(study_track, study_effort, current_year, level_credits, season, not_activated)
+            self.cohort_masks[cohort] = mask
+        return mask
+
+    def cohort_vectors(self, study_track, study_effort, current_year, level_credits, subject_rows, data_version):
+        """
+        returns the candidates of a cohort in any season and activation variant that have a row in the subject matrices.
+
+        args:
+            subject_rows (dict): maps subject names to their rows in the subject matrices of the recommender data.
+            data_version (str): the version of the recommender data, the memoized vectors are dropped when it changes.
+        returns:
+            CohortVectors: the catalog bits (as a numpy array), matrix rows, ids and names of the candidates.
+        """
+        if self.cohort_vectors_version != data_version:
+            self.cohort_vectors_by_cohort = {}
+            self.cohort_vectors_version = data_version
+        cohort = (study_track, study_effort, current_year, level_credits[0] >= 6, level_credits[1] >= 36)
+        vectors = self.cohort_vectors_by_cohort.get(cohort)
+        if vectors is None:
+            candidates = self.cohort_candidates(
+                study_track, study_effort, current_year, level_credits, season=2, not_activated=1
+            )
+            records = [record for record in self.records_of(candidates) if record.name in subject_rows]
+            vectors = CohortVectors(
+                np.array([self.bit_by_id[record.id] for record in records], dtype=np.int64),
+                [subject_rows[record.name] for record in records],
+                [record.id for record in records],
+                [record.name for record in records],
+            )
+            self.cohort_vectors_by_cohort[cohort] = vectors
+        return vectors
+
+    def cohort_revision(self, study_track, study_effort, current_year, level_credits):
+        """
+        returns a digest of the catalog data that the recommendations of a cohort depend on.
+
+        these are the revisions of the subjects that are candidates for the cohort in any season and activation
+        variant, together with the subjects that satisfy their prerequisites. editing one of these subjects,
+        or moving a subject in or out of the cohort's candidates, changes the digest. catalog changes that don't
+        touch the cohort leave it as it is.
+        """
+        cohort = (study_track, study_effort, current_year, level_credits[0] >= 6, level_credits[1] >= 36)
+        revision = self.cohort_revisions.get(cohort)
+        if revision is None:
+            candidates = self.cohort_candidates(
+                study_track, study_effort, current_year, level_credits, season=2, not_activated=1
+            )
+            digest = hashlib.sha256()
+            for bit in iter_bits(candidates):
+                record = self.records[bit]
+                alternatives = self.ids_of(self.prerequisites.alternatives.get(bit, 0))
+                digest.update(f"{record.id}:{record.revision}:{alternatives};".encode())
+            revision = digest.hexdigest()[:16]
+            self.cohort_revisions[cohort] = revision
+        return revision
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_catalog_index():
+    """
+    returns the catalog index of this process, building it on first use.
+
+    other processes signal catalog changes through a version token in the shared cache, which is
+    re-checked at most once every CATALOG_VERSION_CHECK_INTERVAL seconds.
+    """
+    global _index
+    index = _index
+    if index is not None and time.monotonic() - index.checked_at < CATALOG_VERSION_CHECK_INTERVAL:
+        return index
+
+    with _index_lock:
+        shared_version = cache.get(CATALOG_VERSION_CACHE_KEY)
+        if _index is None or _index.shared_version != shared_version:
+            _index = CatalogIndex.build(shared_version)
+        _index.checked_at = time.monotonic()
+        return _index
+
+
+def invalidate_catalog_index():
+    """drops the catalog index of this process and tells all other processes to rebuild theirs."""
+    global _index
+    cache.set(CATALOG_VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+    with _index_lock:
+        _index = None
@@ -13,3 +13,32 @@ WEIGHTS = {
 }
 
 NUMBER_OF_SUGGESTIONS = 6
+
+CATALOG_VERSION_CACHE_KEY = "catalog_index_version"
+# seconds between checks whether another process has changed the catalog
+CATALOG_VERSION_CHECK_INTERVAL = 5
+
+# seconds a computed recommendation stays in the cache
+RECOMMENDATIONS_CACHE_TIMEOUT = 60 * 60 * 24 * 14
+
+# seconds a cached recommendation is served as fresh. after that it is served stale, until
+# RECOMMENDATIONS_CACHE_TIMEOUT, while it is recomputed in the background
+RECOMMENDATIONS_CACHE_FRESH_TIMEOUT = 60 * 60 * 24
+
+# seconds between checks whether the recommender data files have changed
+ARTIFACT_RELOAD_CHECK_INTERVAL = 10
+
+# the season and activation variants of the recommendations that the background jobs compute ahead of time
+PRECOMPUTED_VARIANTS = [(2, 0), (2, 1), (0, 0), (0, 1), (1, 0), (1, 1)]
+
+# background jobs, see subjects/tasks.py
+JOB_MAX_ATTEMPTS = 3
+# seconds before the first retry of a failed job, doubled with every further attempt
+JOB_RETRY_DELAY = 30
+# seconds a worker has to finish a job before it is handed to another worker
+JOB_VISIBILITY_TIMEOUT = 300
+
+# seconds the reviews of a subject are cached, they are also dropped whenever one of them changes, see subjects/reviews.py
+SUBJECT_REVIEWS_CACHE_TIMEOUT = 60 * 60
+# the alias in settings.CACHES of the cached reviews
+SUBJECT_REVIEWS_CACHE_ALIAS = 'reviews'
@@ -1,10 +1,40 @@
 import json
+from contextlib import contextmanager
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.signals import post_delete, pre_delete
 from subjects.serializers import EvaluationReviewSerializer, OtherReviewSerializer
-from subjects.models import Review, Subject, Subject_Info
+from subjects.models import Review, ReviewVote, Subject, Subject_Info
+from subjects.catalog import invalidate_catalog_index
+from subjects.consts import CATALOG_VERSION_CHECK_INTERVAL
+from subjects.tasks import enqueue
+from subjects import signals as subject_signals
 from pathlib import Path
+from auth_form import signals as student_signals
 from auth_form.models import User, Student
 
+# receivers that query or queue jobs for every deleted row, which is done once for all of them by Command.reset instead
+BULK_DELETE_RECEIVERS = [
+    (pre_delete, student_signals.remember_students_that_passed_subject, Subject),
+    (post_delete, student_signals.update_profile_fingerprints_on_subject_delete, Subject),
+    (post_delete, subject_signals.invalidate_catalog, Subject),
+    (pre_delete, subject_signals.remember_deleted_elective_for, Subject_Info),
+    (post_delete, subject_signals.invalidate_catalog, Subject_Info),
+    (post_delete, subject_signals.invalidate_reviews_of_review_subject, Review),
+    (post_delete, subject_signals.count_deleted_vote, ReviewVote),
+    (post_delete, subject_signals.invalidate_reviews_of_vote_subject, ReviewVote),
+]
+
+@contextmanager
+def bulk_delete_receivers_disconnected():
+    for signal, receiver, sender in BULK_DELETE_RECEIVERS:
+        signal.disconnect(receiver, sender=sender)
+    try:
+        yield
+    finally:
+        for signal, receiver, sender in BULK_DELETE_RECEIVERS:
+            signal.connect(receiver, sender=sender)
+
 class Command(BaseCommand):
     help = "Fill db with subjects and subject info from JSON"
 
@@ -15,6 +45,18 @@ class Command(BaseCommand):
             help='Delete existing Subjects and Subject_Info before filling.'
         )
 
+    def reset(self):
+        """
+        deletes the reviews and the subjects. the students lose their passed subjects, so their fingerprints are
+        refreshed together afterwards, and the catalog and the recommendations are refreshed once by handle.
+        """
+        with bulk_delete_receivers_disconnected(), transaction.atomic():
+            Review.objects.all().delete()
+            Subject_Info.objects.all().delete()
+            Subject.objects.all().delete()
+            changed = student_signals.refresh_profile_fingerprints(Student.objects.all())
+        self.stdout.write(f"Refreshed the profile fingerprints of {changed} students.")
+
     def create_subject(self, subject_details):
         subjects = []
         for item in subject_details.values():
@@ -110,9 +152,7 @@ class Command(BaseCommand):
 
         if reset_db:
             self.stdout.write("Reset flag enabled: Clearing existing database entries...")
-            Review.objects.all().delete()
-            Subject_Info.objects.all().delete()
-            Subject.objects.all().delete()
+            self.reset()
 
         base_dir = Path(__file__).resolve().parent.parent
         file_path = base_dir / 'data' / 'subject_details.json'
@@ -127,6 +167,9 @@ class Command(BaseCommand):
         created_subjects = self.create_subject(subject_details)
 
         self.create_subject_info(created_subjects, subject_details)
+        # bulk_create does not send post_save, so the catalog index has to be rebuilt explicitly
+        invalidate_catalog_index()
+        enqueue('warm_up_recommendations', dedupe_key='warm_up', delay=2 * CATALOG_VERSION_CHECK_INTERVAL)
         
         self.stdout.write(self.style.SUCCESS('Subjects and SubjectInfo filled successfully.'))
 
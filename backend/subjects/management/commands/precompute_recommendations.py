@@ -0,0 +1,104 @@
+from django.core.management.base import BaseCommand
+from auth_form.models import Student
+from subjects.artifacts import get_recommender_data
+from subjects.cache import build_cached_response, recommendations_cache
+from subjects.consts import RECOMMENDATIONS_CACHE_FRESH_TIMEOUT, RECOMMENDATIONS_CACHE_TIMEOUT
+from subjects.models import Subject_Info
+from subjects.tasks import enqueue
+from subjects.utils import get_batch_recommendations, get_catalog_version, get_passed_subject_ids, get_recommendations_cache_key
+
+class Command(BaseCommand):
+    help = "Compute the recommendations for all students that have filled the form and store them in the cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of students scored together.'
+        )
+        parser.add_argument(
+            '--season',
+            type=int,
+            choices=[0, 1, 2],
+            default=2,
+            help='Season to compute the recommendations for (0 - summer, 1 - winter, 2 - all).'
+        )
+        parser.add_argument(
+            '--not-activated',
+            type=int,
+            choices=[0, 1],
+            default=0,
+            help='Whether to include subjects that are not activated.'
+        )
+        parser.add_argument(
+            '--subjects',
+            type=int,
+            nargs='+',
+            help='Only recompute the students affected by changes to these subjects, i.e. the students of the study '
+                 'tracks the subjects are elective for, whose cached recommendations are missing or outdated.'
+        )
+        parser.add_argument(
+            '--enqueue',
+            action='store_true',
+            help='Queue the recomputation for the worker (manage.py run_worker) instead of running it here. '
+                 'The worker computes all the variants in PRECOMPUTED_VARIANTS.'
+        )
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            if options['subjects']:
+                enqueue('recompute_subjects_recommendations', {'subject_ids': options['subjects']})
+            else:
+                enqueue('warm_up_recommendations', dedupe_key='warm_up')
+            self.stdout.write(self.style.SUCCESS("Queued the recomputation of the recommendations."))
+            return
+
+        batch_size = options['batch_size']
+        season = options['season']
+        not_activated = options['not_activated']
+
+        students = Student.objects.filter(has_filled_form=True).order_by('id')
+        if options['subjects']:
+            tracks = set()
+            for elective_for in Subject_Info.objects.filter(subject_id__in=options['subjects']).values_list('elective_for', flat=True):
+                tracks.update(elective_for)
+            students = students.filter(study_track__in=tracks)
+        student_count = students.count()
+        cached = 0
+
+        for start in range(0, student_count, batch_size):
+            batch = list(students[start:start + batch_size])
+            # the keys and the recommendations of a batch come from the same snapshot of the recommender data
+            data = get_recommender_data()
+            versions = {student.id: get_catalog_version(student) for student in batch}
+            if options['subjects']:
+                batch = [
+                    student for student in batch
+                    if recommendations_cache.get_entry(
+                        get_recommendations_cache_key(student, season, not_activated, data.version), versions[student.id]
+                    ) is None
+                ]
+            passed_ids = get_passed_subject_ids(batch)
+            recommendations = get_batch_recommendations(batch, season=season, not_activated=not_activated, passed_ids=passed_ids, data=data)
+
+            entries = {}
+            entry_versions = {}
+            for student in batch:
+                payload = recommendations[student.id]
+                if not payload["data"]:
+                    continue
+                cache_key = get_recommendations_cache_key(student, season, not_activated, data.version)
+                entries[cache_key] = build_cached_response(payload)
+                entry_versions[cache_key] = versions[student.id]
+            recommendations_cache.set_many_staleable(
+                entries,
+                timeout=RECOMMENDATIONS_CACHE_FRESH_TIMEOUT,
+                stale_timeout=RECOMMENDATIONS_CACHE_TIMEOUT - RECOMMENDATIONS_CACHE_FRESH_TIMEOUT,
+                versions=entry_versions
+            )
+            cached += len(entries)
+
+            self.stdout.write(f"Processed {min(start + batch_size, student_count)}/{student_count} students.")
+
+        self.stdout.write(self.style.SUCCESS(f"Cached recommendations for {cached} students."))
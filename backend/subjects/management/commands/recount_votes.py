@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from subjects.models import Review, ReviewVote, count_votes_of_type, recount_votes
+
+class Command(BaseCommand):
+    help = "Recompute the vote counters of the reviews whose counters don't match their votes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Recompute the counters of all reviews, not only of the ones that are off.'
+        )
+
+    def handle(self, *args, **options):
+        votes = ReviewVote.objects.all()
+        reviews = Review.objects.all()
+        if not options['all']:
+            off = (Review.objects
+                .annotate(actual_upvotes=count_votes_of_type(votes, 'up'), actual_downvotes=count_votes_of_type(votes, 'down'))
+                .exclude(upvotes=F('actual_upvotes'), downvotes=F('actual_downvotes'), score=F('actual_upvotes') - F('actual_downvotes'))
+                .values_list('id', flat=True)
+            )
+            reviews = reviews.filter(pk__in=list(off))
+
+        updated = recount_votes(reviews, votes)
+        self.stdout.write(self.style.SUCCESS(f"Recounted the votes of {updated} reviews."))
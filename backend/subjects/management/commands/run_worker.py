@@ -0,0 +1,60 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connections
+from subjects.consts import JOB_VISIBILITY_TIMEOUT
+from subjects.tasks import claim_jobs
+from subjects.worker import init_worker_process, run_job
+
+class Command(BaseCommand):
+    help = "Run the queued background jobs (see subjects/tasks.py) in a pool of processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes.'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait before checking for new jobs when the queue is empty.'
+        )
+        parser.add_argument(
+            '--visibility-timeout',
+            type=int,
+            default=JOB_VISIBILITY_TIMEOUT,
+            help='Seconds a job may run before it is handed to another worker.'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is empty instead of waiting for new jobs.'
+        )
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        # spawned processes open their own db connections instead of sharing the ones of this process
+        context = multiprocessing.get_context('spawn')
+        database_names = {alias: connections[alias].settings_dict['NAME'] for alias in connections}
+        self.stdout.write(f"Starting worker with {processes} processes.")
+
+        with ProcessPoolExecutor(
+            max_workers=processes, mp_context=context, initializer=init_worker_process, initargs=(database_names,)
+        ) as pool:
+            while True:
+                job_ids = claim_jobs(processes * 2, options['visibility_timeout'])
+                if not job_ids:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                for _ in pool.map(run_job, job_ids):
+                    pass
+                self.stdout.write(f"Ran {len(job_ids)} jobs.")
+
+        self.stdout.write(self.style.SUCCESS("Job queue is empty."))
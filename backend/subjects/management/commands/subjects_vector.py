@@ -3,9 +3,17 @@ from pathlib import Path
 import json
 from django.core.management.base import BaseCommand
 from numpy import average
+from subjects.artifacts import SUBJECTS_ARTIFACT_PATH, write_subjects_artifact
 
 class Command(BaseCommand):
     help = "Vectorize all subjects"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--binary',
+            action='store_true',
+            help='Also write the vectors as a binary, memory-mappable artifact.'
+        )
     
     def handle(self, *args, **options):
         base_dir = Path(__file__).resolve().parent.parent
@@ -115,3 +123,7 @@ class Command(BaseCommand):
         with open(vocab_file_path, "w", encoding='utf-8') as f:
             json.dump(vocabulary, f, ensure_ascii=False, indent=4)
             self.stdout.write(self.style.SUCCESS(f"Data successfully stored in {vocab_file_path}"))
+
+        if options['binary']:
+            write_subjects_artifact(vectors, vocabulary)
+            self.stdout.write(self.style.SUCCESS(f"Binary artifact successfully stored in {SUBJECTS_ARTIFACT_PATH}"))
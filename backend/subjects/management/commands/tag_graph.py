@@ -1,6 +1,7 @@
 import json
 from django.core.management.base import BaseCommand
 from pathlib import Path
+from subjects.artifacts import TAG_GRAPH_ARTIFACT_PATH, write_tag_graph_artifact
 
 TAGS = [
     "AI / ML",
@@ -91,6 +92,13 @@ def add(tag_graph, tag1, tag2, weight):
 
 class Command(BaseCommand):
     help = "Create a directed, weighted graph of dependencies between all tags present in the vocabulary."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--binary',
+            action='store_true',
+            help='Also write the graph as a binary, memory-mappable weight matrix.'
+        )
     
     def handle(self, *args, **options):
         base_dir = Path(__file__).resolve().parent.parent
@@ -122,12 +130,6 @@ class Command(BaseCommand):
             json.dump(final_tag_graph, f)
             self.stdout.write(self.style.SUCCESS(f"Finished scraping. Data successfully stored in {output_file_path}"))
 
-
-
-
-
-
-
-
-
-
+        if options['binary']:
+            write_tag_graph_artifact(final_tag_graph, len(TAGS))
+            self.stdout.write(self.style.SUCCESS(f"Binary artifact successfully stored in {TAG_GRAPH_ARTIFACT_PATH}"))
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:41
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# a copy of subjects.models.recount_votes as of this migration, the live one may change with the models
+def count_votes_of_type(votes, vote_type):
+    return Coalesce(Subquery(
+        votes.filter(review=OuterRef('pk'), vote_type=vote_type)
+        .order_by().values('review').annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+def fill_vote_counters(apps, schema_editor):
+    Review = apps.get_model('subjects', 'Review')
+    votes = apps.get_model('subjects', 'ReviewVote').objects.all()
+    Review.objects.update(
+        upvotes=count_votes_of_type(votes, 'up'),
+        downvotes=count_votes_of_type(votes, 'down'),
+        score=count_votes_of_type(votes, 'up') - count_votes_of_type(votes, 'down'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subjects', '0009_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='downvotes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='upvotes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['score', 'id'], name='review_score_id_idx'),
+        ),
+        migrations.RunPython(fill_vote_counters, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,8 @@
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import connection, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.contrib.postgres.fields import ArrayField
 from auth_form.models import Student
 
@@ -8,6 +11,8 @@ class Subject(models.Model):
     name = models.TextField(null=False)
     code = models.TextField(null=False)
     abstract = models.TextField()
+    # part of the revision of the subject in the catalog index, see CatalogIndex.cohort_revision
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.code} - {self.name}"
@@ -37,6 +42,7 @@ class Subject_Info(models.Model):
     technologies = ArrayField(models.CharField(max_length=64, blank=True))
     evaluation = ArrayField(models.CharField(max_length=64, blank=True))
     is_easy = models.BooleanField(null=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Subject info for {self.subject.name}"
@@ -62,15 +68,33 @@ class Review(models.Model):
     )
     review_type = models.CharField(max_length=16, choices=REVIEW_TYPE_CHOICES)
     date_posted = models.DateField(auto_now_add=True)
+    # counters of the review's votes, kept up to date in the same transaction as the votes, see count_vote
+    # and toggle_review_vote. `manage.py recount_votes` repairs them
+    upvotes = models.PositiveIntegerField(default=0)
+    downvotes = models.PositiveIntegerField(default=0)
+    score = models.IntegerField(default=0)
+    VOTE_COUNTERS = ('upvotes', 'downvotes', 'score')
 
     def __str__(self):
         return f"Review #{self.id} for {self.subject.name} from {self.student.index}."
 
+    def save(self, *args, **kwargs):
+        # saving a loaded review leaves out the vote counters, which may have changed since it was loaded
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.VOTE_COUNTERS
+            ]
+        super().save(*args, **kwargs)
+
     @property
     def votes_score(self):
-        upvotes = self.reviewvote_set.filter(vote_type='up').count()
-        downvotes = self.reviewvote_set.filter(vote_type='down').count()
-        return upvotes - downvotes
+        return self.score
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['score', 'id'], name='review_score_id_idx'),
+        ]
 
 
 class ReviewVote(models.Model):
@@ -87,6 +111,108 @@ class ReviewVote(models.Model):
             models.UniqueConstraint(fields=['review', 'student'], name='unique_review_per_student')
         ]
 
+
+def count_vote(review_id, vote_type, delta):
+    """
+    adds delta votes of vote_type to the counters of a review, with a single update that is safe under concurrent votes.
+
+    args:
+        review_id (int): the id of the review.
+        vote_type (str): 'up' or 'down'.
+        delta (int): 1 for an added vote, -1 for a removed one.
+    """
+    field = 'upvotes' if vote_type == 'up' else 'downvotes'
+    sign = 1 if vote_type == 'up' else -1
+    Review.objects.filter(pk=review_id).update(**{field: F(field) + delta, 'score': F('score') + sign * delta})
+
+TOGGLE_VOTE_SQL = """
+WITH review AS (
+    SELECT id FROM {review} WHERE id = %(review_id)s
+), previous AS (
+    SELECT id, vote_type FROM {vote} WHERE review_id = %(review_id)s AND student_id = %(student_id)s FOR UPDATE
+), deleted AS (
+    DELETE FROM {vote} WHERE id IN (SELECT id FROM previous WHERE vote_type = %(vote_type)s)
+    RETURNING id
+), updated AS (
+    UPDATE {vote} SET vote_type = %(vote_type)s WHERE id IN (SELECT id FROM previous WHERE vote_type <> %(vote_type)s)
+    RETURNING id
+), inserted AS (
+    INSERT INTO {vote} (review_id, student_id, vote_type)
+    SELECT id, %(student_id)s, %(vote_type)s FROM review WHERE NOT EXISTS (SELECT 1 FROM previous)
+    ON CONFLICT (review_id, student_id) DO NOTHING
+    RETURNING id
+), changes AS (
+    SELECT
+        (SELECT count(*) FROM inserted) + (SELECT count(*) FROM updated) - (SELECT count(*) FROM deleted) AS added,
+        (SELECT count(*) FROM updated) AS switched
+), counted AS (
+    UPDATE {review} SET
+        upvotes = upvotes + CASE WHEN %(vote_type)s = 'up' THEN changes.added ELSE -changes.switched END,
+        downvotes = downvotes + CASE WHEN %(vote_type)s = 'down' THEN changes.added ELSE -changes.switched END,
+        score = score + CASE WHEN %(vote_type)s = 'up' THEN 1 ELSE -1 END * (changes.added + changes.switched)
+    FROM changes
+    WHERE {review}.id IN (SELECT id FROM review)
+    RETURNING {review}.score, {review}.subject_id
+)
+SELECT
+    CASE
+        WHEN EXISTS (SELECT 1 FROM deleted) THEN 'deleted'
+        WHEN EXISTS (SELECT 1 FROM updated) THEN 'updated'
+        WHEN EXISTS (SELECT 1 FROM inserted) THEN 'recorded'
+        ELSE 'unchanged'
+    END,
+    counted.score,
+    (SELECT code FROM {subject} WHERE id = counted.subject_id)
+FROM counted
+"""
+
+def toggle_review_vote(review_id, student_id, vote_type):
+    """
+    toggles the vote of a student on a review and updates the review's counters, in a single statement.
+
+    the vote is deleted if the student has already voted with vote_type, switched if it has voted the other way
+    and recorded otherwise. the statement runs as one transaction, so concurrent clicks can't violate
+    unique_review_per_student or leave the counters off. the ReviewVote signals are not sent.
+    when a concurrent statement has recorded the student's first vote in the meantime, nothing is changed.
+
+    args:
+        review_id (int): the id of the review.
+        student_id (int): the id of the voting student.
+        vote_type (str): 'up' or 'down'.
+    returns:
+        tuple: the action taken ('deleted', 'updated', 'recorded' or 'unchanged'), the new score of the review and
+        the code of its subject, or None if the review doesn't exist.
+    """
+    sql = TOGGLE_VOTE_SQL.format(
+        review=Review._meta.db_table, vote=ReviewVote._meta.db_table, subject=Subject._meta.db_table
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'review_id': review_id, 'student_id': student_id, 'vote_type': vote_type})
+        return cursor.fetchone()
+
+def count_votes_of_type(votes, vote_type):
+    """returns an expression for the number of votes of vote_type of the outer review, for annotating or updating reviews."""
+    return Coalesce(Subquery(
+        votes.filter(review=OuterRef('pk'), vote_type=vote_type)
+        .order_by().values('review').annotate(count=Count('pk')).values('count')
+    ), 0)
+
+def recount_votes(reviews, votes):
+    """
+    recomputes the vote counters of reviews from their votes, in a single update.
+
+    args:
+        reviews (QuerySet): the reviews to recount.
+        votes (QuerySet): the review votes. passed along with the reviews so that migrations can use their historical models.
+    returns:
+        int: the number of updated reviews.
+    """
+    return reviews.update(
+        upvotes=count_votes_of_type(votes, 'up'),
+        downvotes=count_votes_of_type(votes, 'down'),
+        score=count_votes_of_type(votes, 'up') - count_votes_of_type(votes, 'down'),
+    )
+
 class EvaluationReview(models.Model):
     review = models.OneToOneField(Review, on_delete=models.CASCADE, related_name='evaluation_review')
     signature_condition = models.CharField(max_length=64, blank=True)
@@ -137,3 +263,36 @@ class OtherReview(models.Model):
     def __str__(self):
         return f"Review for {self.category} about {self.review.subject.name}."
 
+
+class Job(models.Model):
+    """a background task queued for the worker started with `manage.py run_worker`, see subjects/tasks.py."""
+    STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("failed", "Failed"),
+    ]
+    task = models.CharField(max_length=64)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="queued")
+    # jobs with the same key are only queued once at a time
+    dedupe_key = models.CharField(max_length=128, null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    # a running job whose worker hasn't finished it by then is handed to another worker
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Job #{self.id} {self.task} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedupe_key'], condition=models.Q(status='queued'), name='unique_queued_job'
+            )
+        ]
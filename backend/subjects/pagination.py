@@ -0,0 +1,106 @@
+import base64
+import binascii
+import json
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    paginates a queryset by the values of its ordering fields instead of an offset.
+
+    every page is a range scan from the position of the previous one, so it costs the same however deep it is,
+    and rows added in the meantime don't shift the following pages. the queryset has to be ordered by fields that
+    together are unique (ending with 'id') and all in the same direction, e.g. ('-score', '-id').
+    the position is sent to the client as an opaque cursor in the `next` url.
+
+    counting all rows is as expensive as an offset, so the count is only computed for requests with ?count=true,
+    and is null otherwise.
+    """
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    count_query_param = 'count'
+    default_limit = api_settings.PAGE_SIZE
+    max_limit = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = list(queryset.query.order_by)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        descending = [field.startswith('-') for field in self.ordering]
+        if not self.ordering or self.fields[-1] not in ('id', 'pk') or len(set(descending)) != 1:
+            raise ValueError("KeysetPagination needs an ordering in a single direction that ends with 'id'.")
+
+        limit = self.get_limit(request)
+        self.count = queryset.count() if request.query_params.get(self.count_query_param) == 'true' else None
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.after(position, descending[0]))
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        rows = list(queryset[:limit + 1])
+        self.has_next = len(rows) > limit
+        self.page = rows[:limit]
+        return self.page
+
+    def after(self, position, descending):
+        """returns the condition for the rows that come after position, which holds the values of self.fields."""
+        lookup = 'lt' if descending else 'gt'
+        # the bound on the first field alone lets the database start the scan from the position in the index
+        condition = Q(**{f"{self.fields[0]}__{lookup}e": position[0]})
+        following = Q()
+        for i, field in enumerate(self.fields):
+            equal = dict(zip(self.fields[:i], position[:i]))
+            following |= Q(**equal, **{f"{field}__{lookup}": position[i]})
+        return condition & following
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        if limit <= 0:
+            return self.default_limit
+        return min(limit, self.max_limit)
+
+    def encode_cursor(self, row):
+        payload = {'o': self.ordering, 'p': [getattr(row, field) for field in self.fields]}
+        return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        """returns the position encoded in the cursor of the request, or None on the first page."""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            position = payload['p']
+            ordering = payload['o']
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        # a cursor of another ordering points to an unrelated position
+        if ordering != self.ordering or not isinstance(position, list) or len(position) != len(self.fields):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
@@ -0,0 +1,71 @@
+from django.core.cache import caches
+from django.db import transaction
+from subjects.consts import SUBJECT_REVIEWS_CACHE_ALIAS, SUBJECT_REVIEWS_CACHE_TIMEOUT
+from subjects.models import EvaluationReview, OtherReview, Review, Subject
+from subjects.serializers import EvaluationReviewSerializer, OtherReviewSerializer, get_user_votes
+
+def get_subject_reviews_cache_key(code):
+    return f"subject_reviews_{code}"
+
+def build_subject_reviews(code):
+    """
+    serializes the reviews of a subject with a fixed number of queries, whatever the number of reviews.
+    the votes of the requesting student are not included, every review has user_has_voted set to 'none'.
+
+    returns:
+        dict: the 'evaluation' review and the 'other' reviews of the subject, or None if there is no subject with the code.
+    """
+    if not Subject.objects.filter(code=code).exists():
+        return None
+
+    reviews = Review.objects.filter(subject__code=code)
+    evaluation_review = (EvaluationReview.objects
+        .filter(review__in=reviews)
+        .select_related('review__student', 'review__subject')
+        .prefetch_related('methods__components')
+        .first()
+    )
+    other_reviews = (OtherReview.objects
+        .filter(review__in=reviews)
+        .select_related('review__student', 'review__subject')
+    )
+
+    context = {'user_votes': {}}
+    return {
+        "evaluation": dict(EvaluationReviewSerializer(evaluation_review, context=context).data),
+        "other": [dict(data) for data in OtherReviewSerializer(other_reviews, many=True, context=context).data],
+    }
+
+def with_user_votes(review_data, user_votes):
+    meta = review_data.get('review')
+    if not meta:
+        return review_data
+    return {**review_data, 'review': {**meta, 'user_has_voted': user_votes.get(meta['id'], 'none')}}
+
+def get_subject_reviews(request, code):
+    """
+    returns the reviews of a subject (see build_subject_reviews) from the cache, building and caching them on a miss.
+    the requesting student's votes are looked up with a single query and filled in for every request.
+
+    returns:
+        dict: the 'evaluation' review and the 'other' reviews of the subject, or None if there is no subject with the code.
+    """
+    cache = caches[SUBJECT_REVIEWS_CACHE_ALIAS]
+    cache_key = get_subject_reviews_cache_key(code)
+    reviews = cache.get(cache_key)
+    if reviews is None:
+        reviews = build_subject_reviews(code)
+        if reviews is None:
+            return None
+        cache.set(cache_key, reviews, SUBJECT_REVIEWS_CACHE_TIMEOUT)
+
+    review_ids = [data['review']['id'] for data in [reviews['evaluation'], *reviews['other']] if data.get('review')]
+    user_votes = get_user_votes(request, review_ids)
+    return {
+        "evaluation": with_user_votes(reviews['evaluation'], user_votes),
+        "other": [with_user_votes(data, user_votes) for data in reviews['other']],
+    }
+
+def invalidate_subject_reviews(code):
+    """drops the cached reviews of the subjects with the code, once the current transaction commits."""
+    transaction.on_commit(lambda: caches[SUBJECT_REVIEWS_CACHE_ALIAS].delete(get_subject_reviews_cache_key(code)))
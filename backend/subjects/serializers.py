@@ -42,6 +42,9 @@ class ReviewMetaSerializer(serializers.ModelSerializer):
 
 
     def get_user_has_voted(self, obj):
+        # the votes of a whole page are looked up at once, see get_user_votes
+        if 'user_votes' in self.context:
+            return self.context['user_votes'].get(obj.id, 'none')
         request = self.context.get("request")
         if request and hasattr(request, 'user') and request.user.is_authenticated:
             if hasattr(request.user, 'student'):
@@ -60,6 +63,21 @@ class ReviewMetaSerializer(serializers.ModelSerializer):
     def get_subject(self, obj):
         return {"name": obj.subject.name, "code": obj.subject.code}
 
+def get_user_votes(request, review_ids):
+    """
+    looks up the votes of the requesting student on the given reviews in a single query.
+
+    returns:
+        dict: a dictionary mapping review ids to the student's vote type, for the reviews it has voted on.
+        pass it to the review serializers as context['user_votes'].
+    """
+    user = getattr(request, 'user', None)
+    if not user or not user.is_authenticated or not hasattr(user, 'student'):
+        return {}
+    return dict(
+        ReviewVote.objects.filter(student=user.student, review_id__in=review_ids).values_list('review_id', 'vote_type')
+    )
+
 class EvaluationComponentSerializer(serializers.ModelSerializer):
     class Meta:
         model = EvaluationComponent
@@ -0,0 +1,71 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+from .catalog import invalidate_catalog_index
+from .models import Review, Subject, Subject_Info, ReviewVote, count_vote
+from .reviews import invalidate_subject_reviews
+from .tasks import enqueue_catalog_change
+
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+@receiver(post_save, sender=Subject_Info)
+@receiver(post_delete, sender=Subject_Info)
+def invalidate_catalog(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_catalog_index)
+    enqueue_catalog_change(instance.pk, getattr(instance, '_previous_elective_for', None) or [])
+
+# the students of the tracks a subject was elective for are affected too, which the row doesn't show after the change
+@receiver(pre_save, sender=Subject_Info)
+def remember_previous_elective_for(sender, instance, raw=False, **kwargs):
+    instance._previous_elective_for = None
+    if not raw:
+        instance._previous_elective_for = (
+            Subject_Info.objects.filter(pk=instance.pk).values_list('elective_for', flat=True).first()
+        )
+
+@receiver(pre_delete, sender=Subject_Info)
+def remember_deleted_elective_for(sender, instance, **kwargs):
+    instance._previous_elective_for = instance.elective_for
+
+# the vote counters of a review are updated in the same transaction as its votes
+@receiver(pre_save, sender=ReviewVote)
+def remember_previous_vote_type(sender, instance, raw=False, **kwargs):
+    instance._previous_vote_type = None
+    if instance.pk and not raw:
+        instance._previous_vote_type = ReviewVote.objects.filter(pk=instance.pk).values_list('vote_type', flat=True).first()
+
+@receiver(post_save, sender=ReviewVote)
+def count_saved_vote(sender, instance, raw=False, **kwargs):
+    previous_vote_type = getattr(instance, '_previous_vote_type', None)
+    if raw or previous_vote_type == instance.vote_type:
+        return
+    if previous_vote_type:
+        count_vote(instance.review_id, previous_vote_type, -1)
+    count_vote(instance.review_id, instance.vote_type, 1)
+
+@receiver(post_delete, sender=ReviewVote)
+def count_deleted_vote(sender, instance, **kwargs):
+    count_vote(instance.review_id, instance.vote_type, -1)
+
+# the reviews of a subject are cached together with their scores and the subject's name, see subjects/reviews.py
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+def invalidate_reviews_of_subject(sender, instance, **kwargs):
+    invalidate_subject_reviews(instance.code)
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_reviews_of_review_subject(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    for code in Subject.objects.filter(pk=instance.subject_id).values_list('code', flat=True):
+        invalidate_subject_reviews(code)
+
+# votes toggled by ToggleVote don't send signals, the view drops the cached reviews itself
+@receiver(post_save, sender=ReviewVote)
+@receiver(post_delete, sender=ReviewVote)
+def invalidate_reviews_of_vote_subject(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    for code in Subject.objects.filter(review__id=instance.review_id).values_list('code', flat=True):
+        invalidate_subject_reviews(code)
@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import traceback
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from auth_form.models import Student
+from subjects.artifacts import get_recommender_data
+from subjects.cache import recommendations_cache
+from subjects.consts import (CATALOG_VERSION_CHECK_INTERVAL, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY,
+                             PRECOMPUTED_VARIANTS)
+from subjects.models import Job, Subject_Info
+from subjects.utils import get_catalog_version, get_recommendations_cache_key, refresh_cached_recommendations
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+
+def task(func):
+    """registers a function as a task that can be queued with enqueue, by its name."""
+    TASKS[func.__name__] = func
+    return func
+
+
+def enqueue(task_name, kwargs=None, dedupe_key=None, delay=0):
+    """
+    queues a job for the worker (`manage.py run_worker`) once the current transaction commits.
+
+    args:
+        task_name (str): the name of a function registered with @task.
+        kwargs (dict, optional): the json serializable keyword arguments of the task.
+        dedupe_key (str, optional): the job is not queued if a job with the same key is still waiting.
+        delay (int, optional): seconds before the job may run.
+    """
+    enqueue_many([(task_name, kwargs, dedupe_key)], delay=delay)
+
+
+def enqueue_many(jobs, delay=0):
+    """queues many jobs at once, each given as a (task_name, kwargs, dedupe_key) tuple, see enqueue."""
+    run_after = timezone.now() + timedelta(seconds=delay)
+    queued = [
+        Job(task=task_name, kwargs=kwargs or {}, dedupe_key=dedupe_key, run_after=run_after, max_attempts=JOB_MAX_ATTEMPTS)
+        for task_name, kwargs, dedupe_key in jobs
+    ]
+    # conflicts with the dedupe keys of waiting jobs are skipped
+    transaction.on_commit(lambda: Job.objects.bulk_create(queued, ignore_conflicts=True, batch_size=1000))
+
+
+def enqueue_student_recommendations(student_ids, delay=0):
+    enqueue_many(
+        [('recompute_student_recommendations', {'student_id': student_id}, f"student_{student_id}") for student_id in student_ids],
+        delay=delay
+    )
+
+
+@task
+def recompute_student_recommendations(student_id):
+    """computes the recommendations of a student for all PRECOMPUTED_VARIANTS and stores them in the cache."""
+    student = Student.objects.filter(pk=student_id, has_filled_form=True).first()
+    if student is None:
+        return
+    data = get_recommender_data()
+    for season, not_activated in PRECOMPUTED_VARIANTS:
+        refresh_cached_recommendations(student, season=season, not_activated=not_activated, data=data)
+
+
+@task
+def recompute_subjects_recommendations(subject_ids, tracks=()):
+    """
+    queues the recomputation of the students affected by changes to the given subjects, i.e. the students of the
+    study tracks the subjects are elective for, whose cached recommendations are missing or outdated.
+
+    args:
+        subject_ids (list): the ids of the changed subjects.
+        tracks (list, optional): the tracks the subjects were elective for before the change, which the current
+            rows don't show anymore once a subject is deleted or a track is removed from its elective_for.
+    """
+    tracks = set(tracks)
+    for elective_for in Subject_Info.objects.filter(subject_id__in=subject_ids).values_list('elective_for', flat=True):
+        tracks.update(elective_for)
+    season, not_activated = PRECOMPUTED_VARIANTS[0]
+    data_version = get_recommender_data().version
+    affected = [
+        student.id
+        for student in Student.objects.filter(has_filled_form=True, study_track__in=tracks)
+        if recommendations_cache.get_entry(
+            get_recommendations_cache_key(student, season, not_activated, data_version), get_catalog_version(student)
+        ) is None
+    ]
+    enqueue_student_recommendations(affected)
+
+
+@task
+def warm_up_recommendations():
+    """queues the recomputation of the recommendations of every student that has filled the form."""
+    enqueue_student_recommendations(Student.objects.filter(has_filled_form=True).values_list('id', flat=True))
+
+
+def enqueue_catalog_change(subject_id, tracks=()):
+    """
+    queues the recomputation of the students affected by a change to a subject. the job waits until the other
+    processes have noticed the change, see get_catalog_index.
+
+    args:
+        subject_id (int): the id of the changed subject.
+        tracks (iterable, optional): the tracks the subject was elective for before the change.
+    """
+    tracks = sorted(set(tracks))
+    # a waiting job of the same subject only covers the tracks it was queued with
+    enqueue(
+        'recompute_subjects_recommendations', {'subject_ids': [subject_id], 'tracks': tracks},
+        dedupe_key=f"subject_{subject_id}_{hashlib.md5(','.join(tracks).encode()).hexdigest()}", delay=2 * CATALOG_VERSION_CHECK_INTERVAL
+    )
+
+
+def claim_jobs(limit, visibility_timeout):
+    """
+    takes up to limit jobs that are due, including running jobs whose worker didn't finish them in time.
+    rows locked by other workers are skipped, so every job is claimed by one worker.
+
+    returns:
+        list: the ids of the claimed jobs.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(Job.objects
+            .select_for_update(skip_locked=True)
+            .filter(Q(status='queued', run_after__lte=now) | Q(status='running', locked_until__lt=now))
+            .order_by('run_after', 'id')[:limit]
+        )
+        for job in jobs:
+            job.status = 'running'
+            job.locked_until = now + timedelta(seconds=visibility_timeout)
+            job.attempts += 1
+        Job.objects.bulk_update(jobs, ['status', 'locked_until', 'attempts'])
+    return [job.id for job in jobs]
+
+
+def fail_job(job, error):
+    """queues a failed job again after an exponential backoff, or marks it as failed after its last attempt."""
+    job.last_error = error
+    job.locked_until = None
+    if job.attempts >= job.max_attempts:
+        job.status = 'failed'
+        job.save(update_fields=['status', 'last_error', 'locked_until'])
+        logger.error("job %s failed after %s attempts: %s", job.id, job.attempts, error)
+        return
+
+    job.status = 'queued'
+    job.run_after = timezone.now() + timedelta(seconds=JOB_RETRY_DELAY * 2 ** (job.attempts - 1))
+    try:
+        with transaction.atomic():
+            job.save(update_fields=['status', 'last_error', 'locked_until', 'run_after'])
+    except IntegrityError:
+        # the same job has been queued again in the meantime, that one will do the work
+        job.delete()
+
+
+def run_job(job_id):
+    """runs a claimed job and removes it once it has succeeded. called in the worker processes, see subjects/worker.py."""
+    job = Job.objects.filter(pk=job_id).first()
+    if job is None:
+        return
+    if job.attempts > job.max_attempts:
+        # claimed again after its last attempt ran out of time
+        fail_job(job, job.last_error or "timed out")
+        return
+
+    func = TASKS.get(job.task)
+    try:
+        if func is None:
+            raise LookupError(f"unknown task {job.task}")
+        func(**job.kwargs)
+    except Exception:
+        fail_job(job, traceback.format_exc())
+    else:
+        job.delete()
@@ -0,0 +1,24 @@
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from subjects.models import Job
+
+
+class RunWorkerTests(TransactionTestCase):
+    # the jobs run in spawned processes with their own connections, so the test data has to be committed
+
+    def test_runs_queued_job(self):
+        Job.objects.create(task='warm_up_recommendations')
+
+        call_command('run_worker', '--once', '--processes', '1')
+
+        self.assertFalse(Job.objects.filter(task='warm_up_recommendations').exists())
+
+    def test_requeues_failed_job(self):
+        job = Job.objects.create(task='missing_task')
+
+        call_command('run_worker', '--once', '--processes', '1')
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("unknown task missing_task", job.last_error)
@@ -1,115 +1,41 @@
+from auth_form.models import Student
+from subjects.catalog import get_catalog_index, mask_to_array
 from subjects.models import Subject
-from pathlib import Path
-import json
-from django.db.models import Q
-import os
-from subjects.consts import BIAS_STUDENT_HAS_ONE, BIAS_SUBJECT_HAS_ONE, WEIGHTS, NUMBER_OF_SUGGESTIONS
-
-base_dir = Path(__file__).resolve().parent
-
-VOCAB_FILE_PATH = base_dir / 'management' / 'data' / 'vocabulary.json'
-TAG_GRAPH_PATH = base_dir / 'management' / 'data' / 'tag_graph.json'
-SUBJECTS_VECTOR_PATH = base_dir / 'management' / 'data' / 'subjects_vector.json'
-if not os.path.exists(VOCAB_FILE_PATH) or not os.path.exists(TAG_GRAPH_PATH) or not os.path.exists(SUBJECTS_VECTOR_PATH):
-    raise FileNotFoundError("required data files are missing. ensure 'vocabulary.json', 'tag_graph.json', and 'subjects_vector.json' are present in the 'management/data' directory.")
-
-with open(VOCAB_FILE_PATH, 'r', encoding='utf-8') as f:
-    VOCABULARY = json.load(f)
-
-with open(SUBJECTS_VECTOR_PATH, 'r', encoding='utf-8') as f:
-    SUBJECTS_VECTOR = json.load(f)
-
-with open(TAG_GRAPH_PATH, 'r', encoding='utf-8') as f:
-    TAG_GRAPH = json.load(f)
-
-def get_recommendations_cache_key(student, season, not_activated):
-    passed_subjects_hash = hash(tuple(sorted(student.passed_subjects.values_list('id', flat=True))))
-    cache_key = (f"student_{student.id}_season_{season}_not_activated_{not_activated}_effort_{student.study_effort}"
-                 f"_year_{student.current_year}_passed_{passed_subjects_hash}")
+from subjects.serializers import SubjectSerializer
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as ComputeTimeoutError
+import heapq
+import threading
+import numpy as np
+from django.conf import settings
+from django.db import connections
+from subjects.artifacts import get_recommender_data, pack_vector
+from subjects.cache import build_cached_response, recommendations_cache
+from subjects.consts import WEIGHTS, NUMBER_OF_SUGGESTIONS, RECOMMENDATIONS_CACHE_FRESH_TIMEOUT, RECOMMENDATIONS_CACHE_TIMEOUT
+
+def get_recommendations_cache_key(student, season, not_activated, data_version):
+    # the profile fingerprint changes whenever the preferences, passed subjects, year or effort change,
+    # so building the key needs no queries. bumping the generation makes all previous keys of the student unreachable.
+    # data_version is the version of the recommender data snapshot the cached value is computed from
+    cache_key = (f"student_{student.id}_gen_{student.recommendations_generation}_season_{season}"
+                 f"_not_activated_{not_activated}_profile_{student.profile_fingerprint}_data_{data_version}")
     return cache_key
 
-def get_eligible_subjects(student, season = 2, not_activated = 0):
-    """
-    determines and returns a list of subjects that a student is eligible to enroll in.
-    args:
-        student: the student instance for whom eligible subjects are being determined.
-        season (int, optional): the season to filter subjects by.
-            - 0: summer
-            - 1: winter
-            - 2: all (default)
-        not_activated (int, optional): whether to exclude subjects that are not activated.
-            - 0: exclude not activated subjects (default)
-            - 1: include not activated subjects
-    returns:
-        list: a list of Subject instances that the student is eligible to enroll in.
+def get_scores_cache_key(student, data_version):
+    # the scores are shared by all season and activation variants of the recommendations
+    return (f"scores_student_{student.id}_gen_{student.recommendations_generation}"
+            f"_profile_{student.profile_fingerprint}_data_{data_version}")
 
-    eligibility criteria:
-        - excludes subjects the student has already passed.
-        - filters subjects by the specified season.
-        - applies additional filters based on the student's study effort:
-            1. only easy subjects from years up to and including the student's current year.
-            2. easy and non-easy subjects from years up to and including the student's current year.
-            3. easy and non-easy subjects from the student's current year only.
-            4. easy and non-easy subjects from the student's current year and above.
-            5. only non-easy subjects from the student's current year and above.
-        - excludes subjects from levels where the student has already fulfilled the credit limit (L1: 6 credits, L2: 36 credits).
-        - further filters subjects to ensure the student meets all prerequisites (credits and required subjects).
-        - only includes subjects that are elective for the student's study track.
+def get_catalog_version(student):
     """
-    passed_ids = set(student.passed_subjects.values_list('id', flat=True))
-    total_credits = student.total_credits
-    level_credits = student.level_credits
-    study_track = student.study_track
-    study_effort = student.study_effort
-    current_year = student.current_year
-    
-    all_subjects = (Subject.objects
-        .exclude(id__in=passed_ids)
-        .select_related('subject_info')
-        .filter(subject_info__elective_for__contains=[study_track])
+    returns the version of the catalog data that the student's recommendations depend on.
+    it changes only when a subject relevant to the student's cohort changes, see CatalogIndex.cohort_revision.
+    """
+    return get_catalog_index().cohort_revision(
+        student.study_track, student.study_effort, student.current_year, student.level_credits
     )
 
-    if not_activated == 0:
-        all_subjects = all_subjects.filter(subject_info__activated=True)
-
-    if season == 0:
-        all_subjects = all_subjects.exclude(subject_info__season='W')
-    elif season == 1:
-        all_subjects = all_subjects.exclude(subject_info__season='S')
-
-    if study_effort < 3:
-        all_subjects = all_subjects.exclude(subject_info__semester__gt=current_year * 2)
-        if study_effort == 1:
-            all_subjects = all_subjects.filter(subject_info__is_easy=True)
-    elif study_effort == 3:
-        eligible_semesters = [current_year * 2, current_year * 2 - 1]
-        all_subjects = all_subjects.filter(
-            subject_info__semester__in=eligible_semesters
-        )
-    else:
-        all_subjects = all_subjects.filter(subject_info__semester__gte=(current_year * 2 - 1))
-        if study_effort == 5:
-            all_subjects = all_subjects.exclude(subject_info__is_easy=True)
-
-    if level_credits[0] >= 6:
-        all_subjects = all_subjects.exclude(subject_info__level=1)
-    if level_credits[1] >= 36:
-        all_subjects = all_subjects.exclude(subject_info__level=2)
-
-    valid_subjects = []
-    for subject in all_subjects:
-        subject_info_ = subject.subject_info
-        prereqs = subject_info_.prerequisite or {}
-        if prereqs.get('credits') and total_credits < prereqs['credits']:
-            continue
-        required_subjects = prereqs.get('subjects')
-        if required_subjects and not passed_ids.intersection(required_subjects): 
-            continue
-        valid_subjects.append(subject)
-
-    return valid_subjects
-
-def get_student_vector(student):
+def get_student_vector(student, data=None):
     """
     generates a vector representation of a student based on a predefined vocabulary.
 
@@ -120,17 +46,19 @@ def get_student_vector(student):
 
     args:
         student: an object representing a student
+        data (RecommenderData, optional): the recommender data to use, see get_recommender_data.
     returns:
         dict: a dictionary containing binary vectors for each vocabulary key, normalized study effort,
         and current year.
     """
 
+    vocabulary = (data or get_recommender_data()).vocabulary
     student_vector = {}
-    for key in VOCABULARY:
+    for key in vocabulary:
         student_values = getattr(student, key, [])
 
         student_vector[key] = []
-        words = VOCABULARY[key]
+        words = vocabulary[key]
         for word in words:
             student_vector[key].append(1 if word in student_values else 0)
 
@@ -140,29 +68,11 @@ def get_student_vector(student):
     return student_vector
 
 
-def map_to_subjects_vector(subjects):
+def score_tags(student_tags, subject_tags, data=None):
     """
-    map a list of subject objects to their corresponding vector representations.
-
-    args:
-        subjects (list): a list of subject objects.
-    returns:
-        dict: a dictionary mapping subject names to their vector representations from SUBJECTS_VECTOR .
-    """
-    filtered_subject_vectors = {}
-    for subject in subjects:
-        vector = SUBJECTS_VECTOR.get(subject.name)
-        if vector:
-            filtered_subject_vectors[subject.name] = vector
-    
-    return filtered_subject_vectors
-
-
-def score_tags(student_vector, subject_vector):
-    """
-    calculates a similarity score between a student's tag vector and a subject's tag vector,
-    using a tag graph to account for relationships between tags.
-    the score is computed as follows:
+    calculates similarity scores between the tag vectors of many students and the tag vectors of many subjects at once,
+    using the compiled tag graph to account for relationships between tags.
+    the score for each student and subject is computed as follows:
     - for each tag, if both student and subject have the tag (value 1), this is a full match, and the score is incremented.
     - if both tags are zeroes, ignore them.
     - if the tags differ but one of them is 1, this is a partial match. the tag graph is used to find neighboring tags and 
@@ -171,120 +81,140 @@ def score_tags(student_vector, subject_vector):
     - the score is normalized by the total number of tags where either the student or subject has the tag.
 
     args:
-            student_vector (dict): a dictionary containing a 'tags' key with a list of binary values representing the student's tags.
-            subject_vector (dict): a dictionary containing a 'tags' key with a list of binary values representing the subject's tags.
+            student_tags (numpy.ndarray): a (students x tags) matrix of binary values representing the students' tags.
+            subject_tags (numpy.ndarray): a (subjects x tags) matrix of binary values representing the subjects' tags.
+            data (RecommenderData, optional): the recommender data to use, see get_recommender_data.
     returns:
-            float: the normalized similarity score between the student and subject tag vectors.
-    """
-    student_tags = student_vector['tags']
-    subject_tags = subject_vector['tags']
-    score = 0
-    tot_count = 0
-    for i in range(len(student_tags)):
-        if student_tags[i] == 1 or subject_tags[i] == 1: tot_count += 1
-        
-        if student_tags[i] == subject_tags[i]: 
-            if student_tags[i] == 1:
-                # full match
-                score += 1
-        else:
-            # partial match
-            neighbors = TAG_GRAPH[str(i)]
-            total_weight = sum(weight for _, weight in neighbors)
-            if student_tags[i] == 1:
-                for neighbor in neighbors: 
-                    if subject_tags[neighbor[0]] == 1: score += neighbor[1] / total_weight * BIAS_STUDENT_HAS_ONE
-            else:
-                for neighbor in neighbors:
-                    if student_tags[neighbor[0]] == 1: score += neighbor[1] / total_weight * BIAS_SUBJECT_HAS_ONE
-    
-    return score / tot_count if tot_count != 0 else 0
+            numpy.ndarray: a (students x subjects) matrix of normalized similarity scores.
+    """
+    data = data or get_recommender_data()
+    full_matches = student_tags @ subject_tags.T
+    # student has the tag, the subject does not: credit for the subject's tags neighboring it
+    student_has_one = student_tags @ ((subject_tags @ data.tag_weights_student_has_one.T) * (1 - subject_tags)).T
+    # subject has the tag, the student does not: credit for the student's tags neighboring it
+    subject_has_one = ((student_tags @ data.tag_weights_subject_has_one.T) * (1 - student_tags)) @ subject_tags.T
+
+    score = full_matches + student_has_one + subject_has_one
+    tot_count = student_tags.sum(axis=1)[:, np.newaxis] + subject_tags.sum(axis=1)[np.newaxis, :] - full_matches
+    return np.divide(score, tot_count, out=np.zeros_like(score), where=tot_count != 0)
+
+def score_students(student_vectors, rows, data=None):
+    """
+    scores many students against many subjects at once.
+
+    the match counts are computed as the popcount of the subject bitsets AND the students' bitsets,
+    and the totals are the precomputed popcounts of the subject rows.
 
-def score_for_preferences(student_vector, eligible_subjects):
+    args:
+        student_vectors (list): a list of student vectors, as returned by get_student_vector.
+        rows (list): the rows in the subject matrices of the subjects to score.
+        data (RecommenderData, optional): the recommender data to use, see get_recommender_data.
+    returns:
+        dict: a dictionary where each key is a preference key and each value is a (students x subjects) matrix of scores.
+        the "tags" scores are not yet normalized.
+    """
+    data = data or get_recommender_data()
+    subject_matrices = data.subject_matrices
+    scores = {}
+    for key in data.vocabulary:
+        if key == "tags":
+            student_tags = np.array([vector[key] for vector in student_vectors], dtype=np.float64)
+            subject_tags = np.unpackbits(subject_matrices[key][rows], axis=1, count=len(data.vocabulary[key]))
+            scores[key] = score_tags(student_tags, subject_tags.astype(np.float64), data)
+            continue
+
+        student_bits = np.array([pack_vector(vector[key]) for vector in student_vectors])
+        subject_bits = subject_matrices[key][rows]
+        match_count = np.bitwise_count(
+            student_bits[:, np.newaxis, :] & subject_bits[np.newaxis, :, :]
+        ).sum(axis=2, dtype=np.float64)
+        tot_count = np.broadcast_to(subject_matrices['totals'][key][rows].astype(np.float64), match_count.shape)
+        scores[key] = np.divide(match_count, tot_count, out=np.zeros_like(match_count), where=tot_count != 0)
+
+    is_easy = subject_matrices['isEasy'][rows] == 1
+    study_effort = np.array([vector["study_effort"] for vector in student_vectors])[:, np.newaxis]
+    scores['effort'] = (((study_effort == 0.4) & is_easy) | ((study_effort == 0.8) & ~is_easy)).astype(np.float64)
+    shape = (len(student_vectors), len(rows))
+    scores['activated'] = np.broadcast_to(subject_matrices['activated'][rows], shape)
+    scores['participant_score'] = np.broadcast_to(subject_matrices['participants'][rows], shape)
+    return scores
+
+def collect_scores(scores, student, columns, subject_names):
     """
-    calculates and returns a dictionary of scores for each eligible subject based on a student's preferences.
+    extracts the scores of one student for a subset of the scored subjects, with the tag scores normalized by the
+    student's best tag score among them.
 
     args:
-        student_vector (dict): a dictionary representing the student's preferences and attributes. 
-        eligible_subjects (dict): a dictionary where each key is a subject name and each value is a dictionary 
+        scores (dict): the score matrices returned by score_students.
+        student (int): the student's row in the score matrices.
+        columns (list): the columns of the subjects to extract.
+        subject_names (list): the names of the subjects, in the same order as columns.
     returns:
         dict: A dictionary where each key is a subject name and each value is a dictionary containing scores for each preference key
-    notes:
-        - the "tags" score is calculated separately and then normalized by the maximum tag score across all subjects.
-        - all other preference scores are calculated as the ratio of matching 1's between student and subject vectors.
-    """
-    subjects_tag_scores = {}
-    max_tag_score = 0
-    for subject in eligible_subjects:
-        subjects_tag_scores[subject] = {}
-        subject_vector = eligible_subjects[subject]
-        for key in student_vector:
-            if key in ["index", "study_effort", "current_year"]: continue
-            if key == "tags":
-                tag_score = score_tags(student_vector, subject_vector)
-                subjects_tag_scores[subject][key] = tag_score
-                max_tag_score = max(tag_score, max_tag_score)
-                continue
-
-            student_values = student_vector[key]
-            subject_values = subject_vector[key]
-            tot_count = 0
-            match_count = 0
-
-            for i in range(len(student_values)):
-                if subject_values[i] == 1:
-                    tot_count += 1
-                    if student_values[i] == 1:
-                        match_count += 1
-            
-            score = match_count / tot_count if tot_count != 0 else 0
-            subjects_tag_scores[subject][key] = score
-        
-        study_effort = student_vector["study_effort"]
-        
-        if (study_effort == 0.4 and subject_vector['isEasy']) or (study_effort == 0.8 and not subject_vector['isEasy']):
-            subjects_tag_scores[subject]['effort'] = 1
-        else:
-            subjects_tag_scores[subject]['effort'] = 0
-            
-        subjects_tag_scores[subject]['activated'] = subject_vector['activated']
-
-        subjects_tag_scores[subject]['participant_score'] = subject_vector['participants']
-    
+    """
+    if not columns:
+        return {}
+    values = {key: matrix[student, columns] for key, matrix in scores.items()}
+    max_tag_score = values['tags'].max()
     if max_tag_score != 0:
-        for subject in eligible_subjects:
-            subjects_tag_scores[subject]['tags'] /= max_tag_score 
+        values['tags'] = values['tags'] / max_tag_score
 
-    return subjects_tag_scores
+    values = {key: column.tolist() for key, column in values.items()}
+    return {
+        name: {key: values[key][i] for key in values}
+        for i, name in enumerate(subject_names)
+    }
 
-def get_explanation_message(criterion, score, student_vector):
-    """Generates a human-readable explanation for a single matching criterion."""
+# Thresholds to decide if a match is significant enough to be an "explanation"
+EXPLANATION_THRESHOLDS = {
+    'tags': 0.7, 'evaluation': 0.5, 'technologies': 0.5,
+    'professors': 0.5, 'assistants': 0.5, 'participant_score': 0.5,
+    'effort': 0 # no threshold for effort, as it is binary
+}
 
-    study_effort = student_vector.get('study_effort', 0)
-    # Thresholds to decide if a match is significant enough to be an "explanation"
-    thresholds = {
-        'tags': 0.7, 'evaluation': 0.5, 'technologies': 0.5,
-        'professors': 0.5, 'assistants': 0.5, 'participant_score': 0.5,
-        'effort': 0 # no threshold for effort, as it is binary
-    }
+EXPLANATION_MESSAGES = {
+    'tags': "Супер совпаѓање со твоите полиња на интерес ({score:.1%})",
+    'evaluation': "Се совпаѓа со твоите посакувани методи на евалуација ({score:.1%})",
+    'technologies': "Се совпаѓа со технологиите кои ги сакаш ({score:.1%})",
+    'professors': "Го предаваат професори кои ги сакаш ({score:.1%})",
+    'assistants': "Има асистенти кои ги сакаш ({score:.1%})",
+    'participant_score': "Одбран од многу студенти",
+    'effort': None, # rendered separately, see render_explanation
+}
+
+# criteria whose messages show the match percentage
+PERCENTAGE_CRITERIA = ('tags', 'evaluation', 'technologies', 'professors', 'assistants')
+
+Explanation = namedtuple('Explanation', ['criterion', 'score'])
+
+def get_explanation(criterion, score, student_vector):
+    """Decides whether a single matching criterion is significant enough to be shown as an explanation."""
 
-    if score < thresholds.get(criterion, 1.0):
+    if score < EXPLANATION_THRESHOLDS.get(criterion, 1.0):
+        return None
+
+    if criterion not in EXPLANATION_MESSAGES:
         return None
 
     if criterion == "effort":
+        study_effort = student_vector.get('study_effort', 0)
         if round(study_effort * 5) not in (2, 4):  # only show for effort==2 or 4
             return None
-        return "Се совпаѓа со твојот вложен труд" if score == 1 else "Не се совпаѓа со твојот вложен труд"
-    
-    messages = {
-        'tags': f"Супер совпаѓање со твоите полиња на интерес ({score:.1%})",
-        'evaluation': f"Се совпаѓа со твоите посакувани методи на евалуација ({score:.1%})",
-        'technologies': f"Се совпаѓа со технологиите кои ги сакаш ({score:.1%})",
-        'professors': f"Го предаваат професори кои ги сакаш ({score:.1%})",
-        'assistants': f"Има асистенти кои ги сакаш ({score:.1%})",
-        'participant_score': f"Одбран од многу студенти",
-    }
-    return messages.get(criterion)
+
+    return Explanation(criterion, score)
+
+def explanation_sort_key(explanation):
+    """explanations with a percentage are ordered by it in descending order, followed by the ones without a percentage."""
+    if explanation.criterion not in PERCENTAGE_CRITERIA:
+        return float('inf')
+    # the percentage as shown in the message, so equal looking percentages keep their order
+    return -round(explanation.score * 100, 1)
+
+def render_explanation(explanation):
+    """Renders an explanation as a human-readable message."""
+    if explanation.criterion == "effort":
+        return "Се совпаѓа со твојот вложен труд" if explanation.score == 1 else "Не се совпаѓа со твојот вложен труд"
+    return EXPLANATION_MESSAGES[explanation.criterion].format(score=explanation.score)
 
 # def get_detailed_tag_matches(student_vector, subject_vector):
 #     """Identifies the specific tags that matched between the student and subject."""
@@ -305,54 +235,465 @@ def get_recommendations_with_details(subjects_tag_scores, student_vector):
     """
     Generates a sorted list of recommended subjects with detailed explanations.
 
+    Only the top NUMBER_OF_SUGGESTIONS subjects by total score are selected (with a partial sort),
+    and explanations are built only for them.
+
     Args:
         subjects_tag_scores (dict): Scores for each subject across different criteria.
 
     Returns:
         list: A list of dictionaries, each containing detailed info for a recommended subject.
     """
-    detailed_results = []
+    if not subjects_tag_scores:
+        return []
 
-    for subject_name, individual_scores in subjects_tag_scores.items():
+    subject_names = list(subjects_tag_scores)
+    total_scores = []
+    for individual_scores in subjects_tag_scores.values():
         total_score = 0
-        weighted_scores = {}
-        explanations = []
+        for criterion, score in individual_scores.items():
+            total_score += WEIGHTS.get(criterion, 0) * score
+        total_scores.append(total_score)
 
+    max_score = max(total_scores) or 1
+    # equivalent to a stable sort in descending order followed by [:NUMBER_OF_SUGGESTIONS]
+    top_subjects = heapq.nlargest(NUMBER_OF_SUGGESTIONS, range(len(subject_names)), key=total_scores.__getitem__)
+
+    detailed_results = []
+    for i in top_subjects:
+        subject_name = subject_names[i]
+        individual_scores = subjects_tag_scores[subject_name]
+
+        explanations = []
         for criterion, score in individual_scores.items():
-            weight = WEIGHTS.get(criterion, 0)
-            weighted_score = weight * score
-            total_score += weighted_score
-            weighted_scores[criterion] = weighted_score
-            
-            message = get_explanation_message(criterion, score, student_vector)
-            if message:
-                explanations.append(message)
-
-            # Sort explanations by their match percentage, it extracts the percentage from the message (e.g. Something (72.8%)) and sorts them in descending order
-            explanations.sort(key=lambda msg: -(float(msg.split('(')[-1].replace('%)', '')) if '(' in msg and '%' in msg else float('-inf')))
-        # primary_reason_criterion = max(weighted_scores, key=weighted_scores.get)
-        # primary_reason_score = individual_scores[primary_reason_criterion]
-        # primary_reason = get_explanation_message(primary_reason_criterion, primary_reason_score)
-        # if not primary_reason:
-        #     primary_reason = f"Добро совпаѓање поради {primary_reason_criterion.replace('_', ' ')}"
-
-        # matching_tags = get_detailed_tag_matches(student_vector, eligible_subjects_dict[subject_name])
+            explanation = get_explanation(criterion, score, student_vector)
+            if explanation:
+                explanations.append(explanation)
+        explanations.sort(key=explanation_sort_key)
 
         detailed_results.append({
             'subject_name': subject_name,
-            'total_score': total_score,
-            # 'primary_reason': primary_reason,
-            'explanations': explanations,
+            'total_score': total_scores[i],
+            'explanations': [render_explanation(explanation) for explanation in explanations],
             'detailed_scores': individual_scores,
-            # 'matching_tags': matching_tags,
-            'match_percentage': min(total_score * 100, 100)
+            'match_percentage': round((total_scores[i] / max_score) * 100, 1),
         })
 
+    return detailed_results
+
+
+def serialize_subjects(subject_names):
+    """
+    serializes the subjects with the given names in a single query.
+
+    returns:
+        dict: a dictionary mapping subject names to their serialized data.
+    """
+    subjects = Subject.objects.filter(name__in=subject_names).select_related('subject_info')
+    return {subject_data['name']: subject_data for subject_data in SubjectSerializer(subjects, many=True).data}
+
+
+def build_recommendations_payload(recommendations, serialized_subjects):
+    """
+    builds the response payload of the recommendations endpoint.
+
+    args:
+        recommendations (list): the recommendations returned by get_recommendations_with_details.
+        serialized_subjects (dict): a dictionary mapping subject names to their serialized data.
+    returns:
+        dict: a dictionary with a 'data' key containing the serialized recommended subjects, in order,
+        each with its 'recommendation_details'.
+    """
+    final_response_data = []
+    for details in recommendations:
+        subject_data = serialized_subjects.get(details['subject_name'])
+        if subject_data is None:
+            continue
+        subject_data = dict(subject_data)
+        subject_data['recommendation_details'] = {
+            'match_percentage': details['match_percentage'],
+            'explanations': details['explanations'],
+        }
+        final_response_data.append(subject_data)
+    return {"data": final_response_data}
+
+
+# the scores of a student for every subject it is eligible for in any variant (season=2, not_activated=1),
+# as (1 x subjects) matrices in the form returned by score_students, with the subjects in catalog order
+ScoredSubjects = namedtuple('ScoredSubjects', ['subject_ids', 'subject_names', 'scores'])
+
+def score_all_variants(student, data=None):
+    """
+    scores a student against the union of the subjects of all season and activation variants.
+    every variant is a subset of these subjects, see select_variant.
+
+    returns:
+        ScoredSubjects: the scored subjects and their raw scores.
+    """
+    data = data or get_recommender_data()
+    catalog = get_catalog_index()
+    # the candidates of the student's cohort are filtered and mapped to their rows only once per cohort,
+    # what is left per student is removing the passed subjects and checking the prerequisites
+    cohort = catalog.cohort_vectors(
+        student.study_track, student.study_effort, student.current_year, student.level_credits,
+        data.subject_matrices['index'], data.version
+    )
+    passed = catalog.mask_of(student.passed_subjects.values_list('id', flat=True))
+    eligible = ~passed & catalog.prerequisites.unlocked_mask(passed, student.total_credits)
+    columns = np.flatnonzero(mask_to_array(eligible, len(catalog.records))[cohort.bits]).tolist()
+    if not columns:
+        return ScoredSubjects([], [], {})
+    student_vector = get_student_vector(student, data)
+    scores = score_students([student_vector], [cohort.rows[column] for column in columns], data)
+    return ScoredSubjects(
+        [cohort.ids[column] for column in columns],
+        [cohort.names[column] for column in columns],
+        {key: np.array(matrix) for key, matrix in scores.items()}
+    )
+
+def get_scored_subjects(student, data=None):
+    """
+    returns the ScoredSubjects of a student from the recommendations cache, computing and caching them on a miss.
+    concurrent misses for the same student are computed once, see TwoTierCache.get_or_set.
+    """
+    data = data or get_recommender_data()
+    return recommendations_cache.get_or_set(
+        get_scores_cache_key(student, data.version),
+        lambda: score_all_variants(student, data),
+        timeout=RECOMMENDATIONS_CACHE_FRESH_TIMEOUT,
+        version=get_catalog_version(student)
+    )
+
+def select_variant(scored_subjects, season=2, not_activated=0):
+    """
+    returns the columns of the scored subjects that belong to a season and activation variant, in catalog order.
+    """
+    catalog = get_catalog_index()
+    variant = catalog.variant_mask(season, not_activated)
+    columns = []
+    for column, subject_id in enumerate(scored_subjects.subject_ids):
+        bit = catalog.bit_by_id.get(subject_id)
+        if bit is not None and variant >> bit & 1:
+            columns.append(column)
+    return columns
+
 
-    max_score = max([res['total_score'] for res in detailed_results]) or 1
-    for res in detailed_results:
-        res['match_percentage'] = round((res['total_score'] / max_score) * 100, 1)
+def get_recommendations(student, season=2, not_activated=0, data=None):
+    """
+    computes the recommendations payload for a single student.
+
+    the student is scored once for all variants (see get_scored_subjects). the variant's subjects are then
+    selected from those scores, and the tag normalization and top-K selection are applied to the variant alone,
+    so the result is the same as scoring only the variant's subjects.
 
-    detailed_results.sort(key=lambda x: x['total_score'], reverse=True)
-    return detailed_results[:NUMBER_OF_SUGGESTIONS]
-    
\ No newline at end of file
+    eligibility criteria:
+        - excludes subjects the student has already passed.
+        - filters subjects by the specified season.
+        - applies additional filters based on the student's study effort:
+            1. only easy subjects from years up to and including the student's current year.
+            2. easy and non-easy subjects from years up to and including the student's current year.
+            3. easy and non-easy subjects from the student's current year only.
+            4. easy and non-easy subjects from the student's current year and above.
+            5. only non-easy subjects from the student's current year and above.
+        - excludes subjects from levels where the student has already fulfilled the credit limit (L1: 6 credits, L2: 36 credits).
+        - further filters subjects to ensure the student meets all prerequisites (credits and required subjects).
+        - only includes subjects that are elective for the student's study track.
+
+    args:
+        student: the student instance.
+        season (int, optional): the season to filter subjects by.
+            - 0: summer
+            - 1: winter
+            - 2: all (default)
+        not_activated (int, optional): whether to exclude subjects that are not activated.
+            - 0: exclude not activated subjects (default)
+            - 1: include not activated subjects
+        data (RecommenderData, optional): the recommender data to use, see get_recommender_data.
+    returns:
+        dict: the response payload, see build_recommendations_payload.
+    """
+    data = data or get_recommender_data()
+    scored_subjects = get_scored_subjects(student, data)
+    columns = select_variant(scored_subjects, season, not_activated)
+    if not columns:
+        return {"data": []}
+
+    student_vector = get_student_vector(student, data)
+    subject_names = [scored_subjects.subject_names[column] for column in columns]
+    subjects_scores = collect_scores(scored_subjects.scores, 0, columns, subject_names)
+    recommendations = get_recommendations_with_details(subjects_scores, student_vector)
+    if not recommendations:
+        return {"data": []}
+
+    serialized_subjects = serialize_subjects([rec['subject_name'] for rec in recommendations])
+    return build_recommendations_payload(recommendations, serialized_subjects)
+
+
+# empty recommendations are not cached
+EMPTY_RECOMMENDATIONS_BODY = build_cached_response({"data": []}).body
+
+def is_cacheable_response(entry):
+    return entry.body != EMPTY_RECOMMENDATIONS_BODY
+
+def get_cached_recommendations(student, season=2, not_activated=0, data=None):
+    """
+    returns the rendered recommendations of a student (a CachedResponse) from the recommendations cache.
+
+    they are rendered once and the cached bytes are sent as they are on every hit. concurrent misses are computed
+    once, and expired entries are served stale while they are recomputed in the compute pool (or without a refresh
+    while the pool is full), see TwoTierCache.get_or_set.
+    catalog changes that affect the student's cohort make the cached entry outdated.
+    the key and the value are computed from the same snapshot of the recommender data.
+    """
+    data = data or get_recommender_data()
+    return recommendations_cache.get_or_set(
+        get_recommendations_cache_key(student, season, not_activated, data.version),
+        lambda: build_cached_response(get_recommendations(student, season=season, not_activated=not_activated, data=data)),
+        timeout=RECOMMENDATIONS_CACHE_FRESH_TIMEOUT,
+        stale_timeout=RECOMMENDATIONS_CACHE_TIMEOUT - RECOMMENDATIONS_CACHE_FRESH_TIMEOUT,
+        cacheable=is_cacheable_response,
+        version=get_catalog_version(student),
+        # stale entries are refreshed in the bounded compute pool, see get_recommendations_within_budget
+        submit=submit_computation,
+    )
+
+def refresh_cached_recommendations(student, season=2, not_activated=0, data=None):
+    """computes the recommendations of a student and stores them in the recommendations cache, replacing any cached entry."""
+    data = data or get_recommender_data()
+    entry = build_cached_response(get_recommendations(student, season=season, not_activated=not_activated, data=data))
+    if is_cacheable_response(entry):
+        recommendations_cache.set_staleable(
+            get_recommendations_cache_key(student, season, not_activated, data.version),
+            entry,
+            timeout=RECOMMENDATIONS_CACHE_FRESH_TIMEOUT,
+            stale_timeout=RECOMMENDATIONS_CACHE_TIMEOUT - RECOMMENDATIONS_CACHE_FRESH_TIMEOUT,
+            version=get_catalog_version(student),
+        )
+    return entry
+
+
+# cohort-wide criteria, the same for every student of a cohort, see get_degraded_recommendations
+COHORT_CRITERIA = ('effort', 'activated', 'participant_score')
+
+def get_degraded_recommendations(student, season=2, not_activated=0):
+    """
+    computes a cheap stand-in for the recommendations of a student, served when the personalised recommendations
+    are not ready within the latency budget, see get_recommendations_within_budget.
+
+    the student's eligible subjects are ranked only by the criteria that are the same for its whole cohort
+    (effort, activation and participants), so nothing is scored against the student's preferences.
+
+    returns:
+        dict: the response payload, see build_recommendations_payload, with 'degraded' set to True.
+    """
+    data = get_recommender_data()
+    catalog = get_catalog_index()
+    cohort = catalog.cohort_vectors(
+        student.study_track, student.study_effort, student.current_year, student.level_credits,
+        data.subject_matrices['index'], data.version
+    )
+    passed = catalog.mask_of(student.passed_subjects.values_list('id', flat=True))
+    eligible = (catalog.cohort_candidates(
+            student.study_track, student.study_effort, student.current_year, student.level_credits,
+            season=season, not_activated=not_activated
+        )
+        & ~passed
+        & catalog.prerequisites.unlocked_mask(passed, student.total_credits)
+    )
+    columns = np.flatnonzero(mask_to_array(eligible, len(catalog.records))[cohort.bits]).tolist()
+    if not columns:
+        return {"data": [], "degraded": True}
+
+    subject_matrices = data.subject_matrices
+    rows = [cohort.rows[column] for column in columns]
+    study_effort = student.study_effort / 5
+    is_easy = subject_matrices['isEasy'][rows] == 1
+    scores = {
+        'effort': (((study_effort == 0.4) & is_easy) | ((study_effort == 0.8) & ~is_easy)).astype(np.float64).tolist(),
+        'activated': subject_matrices['activated'][rows].tolist(),
+        'participant_score': subject_matrices['participants'][rows].tolist(),
+    }
+    subjects_scores = {
+        cohort.names[column]: {criterion: scores[criterion][i] for criterion in COHORT_CRITERIA}
+        for i, column in enumerate(columns)
+    }
+    recommendations = get_recommendations_with_details(subjects_scores, {'study_effort': study_effort})
+    serialized_subjects = serialize_subjects([rec['subject_name'] for rec in recommendations])
+    payload = build_recommendations_payload(recommendations, serialized_subjects)
+    payload['degraded'] = True
+    return payload
+
+
+compute_pool = None
+compute_slots = None
+compute_pool_lock = threading.Lock()
+
+def get_compute_pool():
+    """returns the threads that compute the recommendations for get_recommendations_within_budget."""
+    global compute_pool, compute_slots
+    if compute_pool is None:
+        with compute_pool_lock:
+            if compute_pool is None:
+                compute_slots = threading.BoundedSemaphore(settings.RECOMMENDATIONS_COMPUTE_QUEUE)
+                compute_pool = ThreadPoolExecutor(
+                    max_workers=settings.RECOMMENDATIONS_COMPUTE_THREADS, thread_name_prefix='recommendations-compute'
+                )
+    return compute_pool
+
+def submit_computation(func, *args):
+    """
+    runs func(*args) in the compute pool, unless RECOMMENDATIONS_COMPUTE_QUEUE computations are already running or
+    waiting for a thread.
+
+    returns:
+        Future: the future of the computation, or None if it was not submitted.
+    """
+    pool = get_compute_pool()
+    if not compute_slots.acquire(blocking=False):
+        return None
+    future = pool.submit(func, *args)
+    future.add_done_callback(lambda _: compute_slots.release())
+    return future
+
+def compute_cached_recommendations(student, season, not_activated, data, version):
+    """computes and caches the recommendations of a student in the compute pool, the lock of their key is already taken."""
+    cache_key = get_recommendations_cache_key(student, season, not_activated, data.version)
+    try:
+        return recommendations_cache.compute_and_set(
+            cache_key,
+            lambda: build_cached_response(get_recommendations(student, season=season, not_activated=not_activated, data=data)),
+            RECOMMENDATIONS_CACHE_FRESH_TIMEOUT,
+            RECOMMENDATIONS_CACHE_TIMEOUT - RECOMMENDATIONS_CACHE_FRESH_TIMEOUT,
+            is_cacheable_response,
+            version,
+        )
+    finally:
+        recommendations_cache.release(cache_key)
+        # the db connections of this thread are not closed at the end of a request
+        connections.close_all()
+
+def get_recommendations_within_budget(student, season=2, not_activated=0, budget=None):
+    """
+    returns the rendered recommendations of a student like get_cached_recommendations, but waits for their
+    computation on a miss for at most budget seconds.
+
+    the computation runs in the compute pool and is not interrupted when the budget runs out: it goes on in the
+    background and caches its result, so one of the next requests of the student is a hit. when the pool already
+    has RECOMMENDATIONS_COMPUTE_QUEUE computations, nothing is submitted and None is returned right away, and the
+    recomputation of the student is queued for the worker (see subjects/tasks.py) instead.
+    a miss that is already being computed elsewhere is waited for in the calling thread, the pool only gets the
+    keys it can lock.
+
+    args:
+        budget (float, optional): seconds to wait, settings.RECOMMENDATIONS_LATENCY_BUDGET if not given. 0 waits as long as it takes.
+    returns:
+        CachedResponse: the recommendations, or None if they were not ready in time.
+    """
+    budget = settings.RECOMMENDATIONS_LATENCY_BUDGET if budget is None else budget
+    data = get_recommender_data()
+    cache_key = get_recommendations_cache_key(student, season, not_activated, data.version)
+    version = get_catalog_version(student)
+    # hits, including stale ones, are answered right away without handing them to the pool
+    if not budget or recommendations_cache.get_entry(cache_key, version) is not None:
+        return get_cached_recommendations(student, season=season, not_activated=not_activated, data=data)
+
+    if not recommendations_cache.acquire(cache_key):
+        entry = recommendations_cache.wait_for(cache_key, version, timeout=budget)
+        return entry.value if entry is not None else None
+    # the value may have been stored between the miss and taking the lock
+    entry = recommendations_cache.get_entry(cache_key, version)
+    future = None
+    if entry is None:
+        future = submit_computation(compute_cached_recommendations, student, season, not_activated, data, version)
+    if future is None:
+        recommendations_cache.release(cache_key)
+        if entry is not None:
+            return entry.value
+        # the pool is full, the worker caches them for one of the next requests instead
+        from subjects.tasks import enqueue_student_recommendations
+        enqueue_student_recommendations([student.pk])
+        return None
+    try:
+        return future.result(timeout=budget)
+    except ComputeTimeoutError:
+        return None
+
+
+def get_passed_subject_ids(students):
+    """
+    loads the passed subjects of many students in a single query.
+
+    returns:
+        dict: a dictionary mapping student ids to lists of passed subject ids.
+    """
+    passed_ids = {student.id: [] for student in students}
+    passed_subjects = (Student.passed_subjects.through.objects
+        .filter(student_id__in=passed_ids)
+        .values_list('student_id', 'subject_id')
+    )
+    for student_id, subject_id in passed_subjects:
+        passed_ids[student_id].append(subject_id)
+    return passed_ids
+
+
+def get_batch_recommendations(students, season=2, not_activated=0, passed_ids=None, data=None):
+    """
+    computes the recommendations payloads for many students at once.
+
+    the passed subjects of all students are loaded in one query, all students are scored against the whole
+    catalog in matrix form, and eligibility (including prerequisites) is evaluated as a (students x subjects) mask.
+    the results are identical to calling get_recommendations for each student.
+
+    args:
+        students (iterable): the student instances.
+        season (int, optional): the season to filter subjects by, see get_recommendations.
+        not_activated (int, optional): whether to include not activated subjects, see get_recommendations.
+        passed_ids (dict, optional): the passed subject ids of each student, as returned by get_passed_subject_ids.
+            loaded in one query when not given.
+        data (RecommenderData, optional): the recommender data to use, see get_recommender_data.
+    returns:
+        dict: a dictionary mapping student ids to their response payloads.
+    """
+    students = list(students)
+    if not students:
+        return {}
+    if passed_ids is None:
+        passed_ids = get_passed_subject_ids(students)
+
+    catalog = get_catalog_index()
+    passed = np.zeros((len(students), len(catalog.records)), dtype=bool)
+    for i, student in enumerate(students):
+        for subject_id in passed_ids[student.id]:
+            bit = catalog.bit_by_id.get(subject_id)
+            if bit is not None:
+                passed[i, bit] = True
+
+    eligible = ~passed & catalog.prerequisites.unlocked_matrix(passed, [student.total_credits or 0 for student in students])
+    for i, student in enumerate(students):
+        eligible[i] &= mask_to_array(catalog.cohort_candidates(
+            student.study_track, student.study_effort, student.current_year, student.level_credits,
+            season=season, not_activated=not_activated
+        ), len(catalog.records))
+
+    # only subjects with a vector can be scored
+    data = data or get_recommender_data()
+    index = data.subject_matrices['index']
+    scored_bits = [bit for bit, record in enumerate(catalog.records) if record.name in index]
+    subject_names = [catalog.records[bit].name for bit in scored_bits]
+    student_vectors = [get_student_vector(student, data) for student in students]
+    scores = score_students(student_vectors, [index[name] for name in subject_names], data)
+    eligible = eligible[:, scored_bits]
+
+    recommendations = {}
+    for i, student in enumerate(students):
+        columns = np.flatnonzero(eligible[i]).tolist()
+        subjects_scores = collect_scores(scores, i, columns, [subject_names[column] for column in columns])
+        recommendations[student.id] = get_recommendations_with_details(subjects_scores, student_vectors[i])
+
+    serialized_subjects = serialize_subjects({
+        rec['subject_name'] for student_recommendations in recommendations.values() for rec in student_recommendations
+    })
+    return {
+        student_id: build_recommendations_payload(student_recommendations, serialized_subjects)
+        for student_id, student_recommendations in recommendations.items()
+    }
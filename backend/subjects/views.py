@@ -1,17 +1,18 @@
-import json
 from django.http import HttpResponse
-from django.core.cache import cache
 from django.shortcuts import get_object_or_404
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Case, When, Count, F, Q
-from subjects.utils import get_eligible_subjects, get_recommendations_cache_key, get_recommendations_with_details, map_to_subjects_vector, score_for_preferences, get_student_vector
-from .serializers import SubjectSerializer, EvaluationReviewSerializer, OtherReviewSerializer
-from .models import Subject, Review, EvaluationReview, OtherReview, ReviewVote
+from django.db import transaction
+from subjects.cache import cached_response
+from subjects.reviews import get_subject_reviews, invalidate_subject_reviews
+from subjects.utils import get_degraded_recommendations, get_recommendations_within_budget
+from .serializers import SubjectSerializer, EvaluationReviewSerializer, OtherReviewSerializer, get_user_votes
+from .models import Subject, Review, toggle_review_vote
 from rest_framework.pagination import LimitOffsetPagination
+from .pagination import KeysetPagination
 from auth_form.permissions import IsStudent, IsAdmin
 import logging
 
@@ -38,52 +39,13 @@ class RecommendationsView(APIView):
         student = request.user.student
         if not student:
             return Response({"message": "Could not find student"}, status=status.HTTP_400_BAD_REQUEST)
-        cache_key = get_recommendations_cache_key(student, season, not_activated)
-        if cache_key:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(json.loads(cached_data), status=status.HTTP_200_OK)
         try:
-            eligible_subjects = get_eligible_subjects(student, season=season, not_activated=not_activated)
-            if not eligible_subjects:
-                return Response({"data": []}, status=status.HTTP_200_OK)
-            
-            eligible_subjects_dict = map_to_subjects_vector(eligible_subjects)
-            student_vector = get_student_vector(student)
-
-            subjects_scores = score_for_preferences(student_vector, eligible_subjects_dict)
-            
-            recommendations_with_details = get_recommendations_with_details(
-                subjects_scores, student_vector
-            )
-
-            if not recommendations_with_details:
-                return Response({"data": []}, status=status.HTTP_200_OK)
-            final_subject_names = [rec['subject_name'] for rec in recommendations_with_details]
-            details_map = {rec['subject_name']: rec for rec in recommendations_with_details}
-
-            order = Case(*[When(name=name, then=pos) for pos, name in enumerate(final_subject_names)])
-            recommended_subject_objects = Subject.objects.filter(name__in=final_subject_names).order_by(order)
-
-            serializer = SubjectSerializer(recommended_subject_objects, many=True)
-            
-            final_response_data = []
-            for subject_data in serializer.data:
-                details = details_map.get(subject_data['name'])
-                if details:
-                    subject_data['recommendation_details'] = {
-                        'match_percentage': details['match_percentage'],
-                        # 'primary_reason': details['primary_reason'],
-                        'explanations': details['explanations'],
-                        # 'matching_tags': details['matching_tags'],
-                        # 'detailed_scores': details['detailed_scores']
-                    }
-                final_response_data.append(subject_data)
-
-            response_payload = {"data": final_response_data}
-            if cache_key:
-                cache.set(cache_key, json.dumps(response_payload), timeout=60 * 60 * 24 * 14)
-            return Response(response_payload, status=status.HTTP_200_OK)
+            entry = get_recommendations_within_budget(student, season=season, not_activated=not_activated)
+            if entry is None:
+                # the full recommendations are still being computed and cached, so they are not stored by the client
+                payload = get_degraded_recommendations(student, season=season, not_activated=not_activated)
+                return Response(payload, headers={'Cache-Control': 'no-store'})
+            return cached_response(request, entry)
 
         except Exception as e:
             logging.error(f"Recommendation error for student {student.id}: {e}", exc_info=True)
@@ -187,27 +149,29 @@ class SubjectReview(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        review = Review.objects.create(
-            student=student,
-            subject=subject,
-            review_type=review_type
-        )
-
-        if review_type == "evaluation":
-            serializer = EvaluationReviewSerializer(data=request.data, context={'review': review})
-        else:
-            serializer = OtherReviewSerializer(data=request.data, context={'review': review})
+        # the cached reviews of the subject are dropped once the review is saved along with its details
+        with transaction.atomic():
+            review = Review.objects.create(
+                student=student,
+                subject=subject,
+                review_type=review_type
+            )
 
-        if serializer.is_valid():
-            serializer.save()
-            return Response({
-                    "message": f"{review_type.capitalize()} review created.",
-                    "review_id": review.id,
-                    },
-                status=status.HTTP_201_CREATED)
-        else:
-            review.delete()
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            if review_type == "evaluation":
+                serializer = EvaluationReviewSerializer(data=request.data, context={'review': review})
+            else:
+                serializer = OtherReviewSerializer(data=request.data, context={'review': review})
+
+            if serializer.is_valid():
+                serializer.save()
+                return Response({
+                        "message": f"{review_type.capitalize()} review created.",
+                        "review_id": review.id,
+                        },
+                    status=status.HTTP_201_CREATED)
+            else:
+                review.delete()
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class AdminSubjectReview(APIView):
     def get_permissions(self):
@@ -227,28 +191,16 @@ class AdminSubjectReview(APIView):
         if is_confirmed is None:
             return Response({"message": "Missing is_confirmed param."}, status=status.HTTP_400_BAD_REQUEST)
         review.is_confirmed = is_confirmed
-        review.save()
+        # the vote counters are updated concurrently by the votes, saving all fields would overwrite them
+        review.save(update_fields=['is_confirmed'])
         return Response({"message": "Review confirmed"}, status=status.HTTP_200_OK)
     
 class ReviewsForSubject(APIView):
     def get(self, request, code):
-        subject = Subject.objects.filter(code=code)
-        if not subject.exists():
+        reviews = get_subject_reviews(request, code)
+        if reviews is None:
             return Response({'error': 'Subject not found.'}, status=status.HTTP_404_NOT_FOUND)
-
-        reviews = Review.objects.filter(subject__code=code)
-
-        evaluation_review = EvaluationReview.objects.filter(review__in=reviews).first()
-        other_reviews = OtherReview.objects.filter(review__in=reviews)
-
-        context = {'request': request}
-        evaluation_serializer = EvaluationReviewSerializer(evaluation_review, context=context)
-        other_serializer = OtherReviewSerializer(other_reviews, many=True, context=context)
-
-        return Response({
-            "evaluation": evaluation_serializer.data,
-            "other": other_serializer.data
-        }, status=status.HTTP_200_OK)
+        return Response(reviews, status=status.HTTP_200_OK)
 
 class ToggleVote(APIView):
     permission_classes = [IsAuthenticated]
@@ -261,24 +213,28 @@ class ToggleVote(APIView):
         if not review_id:
             return Response({"error": "Review ID is required."}, status=status.HTTP_400_BAD_REQUEST)
 
+        try:
+            review_id = int(review_id)
+        except (TypeError, ValueError):
+            return Response({"error": "Invalid review ID."}, status=status.HTTP_400_BAD_REQUEST)
+
         student = request.user.student
 
-        try:
-            review = Review.objects.get(pk=review_id)
-        except Review.DoesNotExist:
+        result = toggle_review_vote(review_id, student.id, vote_type)
+        if result is None:
             return Response({"error": "Review not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        try:
-            vote = ReviewVote.objects.get(review=review, student=student)
-            if vote.vote_type == vote_type:
-                vote.delete()
-                return Response({"message": "Vote deleted.", "vote_score": review.votes_score}, status=status.HTTP_200_OK)
-            vote.vote_type = vote_type
-            vote.save()
-            return Response({"message": "Vote updated.", "vote_score": review.votes_score}, status=status.HTTP_200_OK)
-        except ReviewVote.DoesNotExist:
-            ReviewVote.objects.create(review=review, student=student, vote_type=vote_type)
-            return Response({"message": "Vote recorded.", "vote_score": review.votes_score}, status=status.HTTP_201_CREATED)
+        action, score, subject_code = result
+        if action == 'unchanged':
+            # a concurrent request of the student has recorded its vote first
+            return Response({"message": "Vote already recorded.", "vote_score": score}, status=status.HTTP_200_OK)
+        # the scores are part of the cached reviews of the subject
+        invalidate_subject_reviews(subject_code)
+        if action == 'deleted':
+            return Response({"message": "Vote deleted.", "vote_score": score}, status=status.HTTP_200_OK)
+        if action == 'updated':
+            return Response({"message": "Vote updated.", "vote_score": score}, status=status.HTTP_200_OK)
+        return Response({"message": "Vote recorded.", "vote_score": score}, status=status.HTTP_201_CREATED)
 
 class ReviewListView(APIView):
     permission_classes = [IsAuthenticated]
@@ -320,33 +276,37 @@ class ReviewListView(APIView):
             return Response({"message": "Invalid sort_order param."}, status=status.HTTP_400_BAD_REQUEST)
 
         if sort_by == 'votes':
-            review_query_set = review_query_set.annotate(
-                vote_score=Count('votes', filter=Q(reviewvote__vote_type='up')) -
-                           Count('votes', filter=Q(reviewvote__vote_type='down'))
-            )
-
             if sort_order == 'desc':
-                review_query_set = review_query_set.order_by('-vote_score', '-id')
+                review_query_set = review_query_set.order_by('-score', '-id')
             else:
-                review_query_set = review_query_set.order_by('vote_score', 'id')
+                review_query_set = review_query_set.order_by('score', 'id')
         else:  
             if sort_order == 'desc':
                 review_query_set = review_query_set.order_by('-id')
             else:
                 review_query_set = review_query_set.order_by('id')
 
-        review_query_set = review_query_set.select_related("evaluation_review", "other_review")
+        review_query_set = (review_query_set
+            .select_related("evaluation_review", "other_review", "student", "subject")
+            .prefetch_related("evaluation_review__methods__components")
+        )
 
-        paginator = LimitOffsetPagination()
+        # ?pagination=cursor pages by the position in the ordering instead of an offset, see KeysetPagination
+        if request.query_params.get('pagination') == 'cursor':
+            paginator = KeysetPagination()
+        else:
+            paginator = LimitOffsetPagination()
         paginated_query_set = paginator.paginate_queryset(review_query_set, request)
 
+        # a page costs the same number of queries regardless of its size
+        context = {'request': request, 'user_votes': get_user_votes(request, [review.id for review in paginated_query_set])}
         data = []
         for review in paginated_query_set:
             if review.review_type == 'evaluation' and hasattr(review, "evaluation_review"):
-                    serializer = EvaluationReviewSerializer(review.evaluation_review, context={'request': request})
+                    serializer = EvaluationReviewSerializer(review.evaluation_review, context=context)
                     data.append(serializer.data)
             elif review.review_type == 'other' and hasattr(review, "other_review"):
-                serializer = OtherReviewSerializer(review.other_review, context={'request': request})
+                serializer = OtherReviewSerializer(review.other_review, context=context)
                 data.append(serializer.data)
 
         return paginator.get_paginated_response(data)
\ No newline at end of file
@@ -0,0 +1,29 @@
+"""
+entry points of the worker processes of `manage.py run_worker`.
+
+the processes are spawned, so they import this module before django is set up. it mustn't import models (or
+modules that do, like subjects.tasks) at module level, they're only imported once init_worker_process has run.
+"""
+import django
+from django.apps import apps
+from django.conf import settings
+
+
+def init_worker_process(database_names):
+    """
+    sets django up in a freshly spawned worker process.
+
+    args:
+        database_names (dict): the database name of each connection alias of the parent process, so the jobs use the
+            same databases as the command that claimed them (e.g. the test database).
+    """
+    for alias, name in database_names.items():
+        settings.DATABASES[alias]['NAME'] = name
+    if not apps.ready:
+        django.setup()
+
+
+def run_job(job_id):
+    """runs a claimed job, see subjects.tasks.run_job."""
+    from subjects.tasks import run_job
+    run_job(job_id)
@@ -14,7 +14,7 @@ import { useAuth } from "../hooks/useAuth";
 type ReviewsList = (OtherReview | EvaluationReview)[];
 
 interface ApiResponse {
-	count: number;
+	count: number | null;
 	next: string | null;
 	previous: string | null;
 	results: ReviewsList;
@@ -92,6 +92,7 @@ const Reviews = () => {
 			}
 			params.append("sort_by", filters.sort_by);
 			params.append("sort_order", filters.sort_order);
+			params.append("pagination", "cursor");
 			if (filters.my_reviews) {
 				params.append("my_reviews", "true");
 			}